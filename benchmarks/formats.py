@@ -0,0 +1,81 @@
+"""
+Encode and decode cost of a page of users in the wire formats of the API,
+measured without the database or HTTP stack:
+
+    python -m benchmarks.formats --rows 1000
+"""
+import argparse
+import json
+from datetime import datetime
+
+import msgpack
+from faker import Faker
+
+from benchmarks.run import measure
+from picpay_case.api.formats import packb
+from picpay_case.schemas.response import success_dict, success_json
+from picpay_case.schemas.user import user_list_adapter
+from tests.factories import make_user_data
+
+
+def make_page(rows: int) -> list:
+    fake = Faker()
+    now = datetime.utcnow()
+    return user_list_adapter.validate_python([
+        dict(make_user_data(fake), id=i, created_at=now, updated_at=now)
+        for i in range(rows)
+    ])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    page = make_page(args.rows)
+    as_json = success_json(page)
+    as_msgpack = packb(success_dict(page))
+
+    results = {
+        "json": {
+            "bytes": len(as_json),
+            "encode": measure(lambda i: success_json(page), args.iterations),
+            "decode": measure(lambda i: json.loads(as_json), args.iterations),
+            # What a client needs before using the timestamps
+            "decode_datetimes": measure(
+                lambda i: [
+                    (datetime.fromisoformat(u["created_at"]),
+                     datetime.fromisoformat(u["updated_at"]))
+                    for u in json.loads(as_json)["data"]
+                ],
+                args.iterations
+            ),
+        },
+        "msgpack": {
+            "bytes": len(as_msgpack),
+            "encode": measure(
+                lambda i: packb(success_dict(page)), args.iterations
+            ),
+            "decode": measure(
+                lambda i: msgpack.unpackb(as_msgpack, timestamp=3),
+                args.iterations
+            ),
+        },
+    }
+
+    for name, result in results.items():
+        print(
+            f"{name:8} {result['bytes']:>9} bytes  "
+            f"encode p50 {result['encode']['p50_ms']:.2f} ms  "
+            f"decode p50 {result['decode']['p50_ms']:.2f} ms"
+        )
+    print(
+        "json decode with datetimes parsed p50 "
+        f"{results['json']['decode_datetimes']['p50_ms']:.2f} ms"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
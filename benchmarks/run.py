@@ -0,0 +1,411 @@
+"""
+Performance benchmarks for UserOperations and the /users endpoints.
+
+Seeds a SQLite database per size with the test user factory, times each
+operation and endpoint (the endpoints through the ASGI app), writes the
+results as JSON and compares them against the stored baseline:
+
+    python -m benchmarks.run --sizes 10000 100000 1000000
+    python -m benchmarks.run --sizes 10000 --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+import sqlalchemy
+from faker import Faker
+from sqlalchemy.orm import sessionmaker
+
+from picpay_case.api.pagination import encode_cursor
+from picpay_case.database import create_db_engine, get_db
+from picpay_case.main import app
+from picpay_case.migrations import migrate
+from picpay_case.operations.async_user import user_cache
+from picpay_case.operations.user import UserOperations
+from picpay_case.schemas.user import UserCreate, UserUpdate
+from tests.factories import make_user_data
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+SEED_BATCH = 5000
+PAGE_SIZE = 100
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(samples: List[float], elapsed: float) -> dict:
+    ordered = sorted(samples)
+
+    def _percentile(p: float) -> float:
+        index = round(p / 100 * (len(ordered) - 1))
+        return ordered[index] * 1000
+
+    return {
+        "count": len(samples),
+        "p50_ms": _percentile(50),
+        "p95_ms": _percentile(95),
+        "p99_ms": _percentile(99),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "ops_per_s": len(samples) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure(fn: Callable[[int], object], iterations: int) -> dict:
+    samples = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - t)
+    return summarize(samples, time.perf_counter() - start)
+
+
+async def measure_async(
+    fn: Callable[[int], Awaitable[object]],
+    iterations: int,
+    concurrency: int
+) -> dict:
+    samples = []
+    indexes = iter(range(iterations))
+
+    async def _worker():
+        for i in indexes:
+            t = time.perf_counter()
+            await fn(i)
+            samples.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_worker() for _ in range(concurrency)])
+    return summarize(samples, time.perf_counter() - start)
+
+
+def unique_user(fake: Faker, prefix: str) -> dict:
+    # Faker repeats emails on large runs, the prefix keeps them unique
+    data = make_user_data(fake)
+    data["email"] = f"{prefix}.{data['email']}"
+    return data
+
+
+def seed(session_factory, size: int, fake: Faker) -> List[int]:
+    ids = []
+    with session_factory() as db:
+        user_op = UserOperations(db)
+        for offset in range(0, size, SEED_BATCH):
+            batch = [
+                UserCreate(**unique_user(fake, f"seed{i}"))
+                for i in range(offset, min(size, offset + SEED_BATCH))
+            ]
+            ids.extend(user_op.create_users(batch))
+    return ids
+
+
+def bench_operations(
+    session_factory,
+    ids: List[int],
+    fake: Faker,
+    iterations: int
+) -> Dict[str, dict]:
+    rnd = random.Random(42)
+    results = {}
+
+    with session_factory() as db:
+        user_op = UserOperations(db)
+
+        results["op.get_user"] = measure(
+            lambda i: user_op.get_user(rnd.choice(ids)), iterations
+        )
+        results["op.get_users_page"] = measure(
+            lambda i: user_op.get_users(PAGE_SIZE, rnd.choice(ids)),
+            iterations
+        )
+        results["op.get_users_page_stats"] = measure(
+            lambda i: user_op.get_users_page_stats(
+                PAGE_SIZE, rnd.choice(ids)
+            ),
+            iterations
+        )
+
+        # Payloads are built up front so only the operation is timed
+        payloads = [
+            UserCreate(**unique_user(fake, f"op{i}"))
+            for i in range(iterations)
+        ]
+        created = []
+
+        def _create(i):
+            created.append(user_op.create_user(payloads[i]).id)
+
+        results["op.create_user"] = measure(_create, iterations)
+        results["op.update_user"] = measure(
+            lambda i: user_op.update_user(
+                created[i], UserUpdate(first_name=f"Bench{i}")
+            ),
+            iterations
+        )
+        results["op.delete_user"] = measure(
+            lambda i: user_op.delete_user(created[i]), iterations
+        )
+
+        batches = [
+            [
+                UserCreate(**unique_user(fake, f"batch{i}.{j}"))
+                for j in range(1000)
+            ]
+            for i in range(max(1, iterations // 20))
+        ]
+        results["op.create_users_1000"] = measure(
+            lambda i: user_op.create_users(batches[i]), len(batches)
+        )
+        results["op.iter_users"] = measure(
+            lambda i: sum(len(c) for c in user_op.iter_users(1000)), 1
+        )
+
+    return results
+
+
+async def bench_endpoints(
+    session_factory,
+    ids: List[int],
+    fake: Faker,
+    iterations: int,
+    concurrency: int
+) -> Dict[str, dict]:
+    rnd = random.Random(42)
+    results = {}
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def _check(response: httpx.Response):
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f"{response.request.method} {response.request.url} "
+                f"returned {response.status_code}: {response.text[:200]}"
+            )
+
+    app.dependency_overrides[get_db] = override_get_db
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+
+            async def _get_user(i):
+                await _check(await client.get(f"/users/{rnd.choice(ids)}"))
+
+            if user_cache is not None:
+                user_cache.clear()
+            results["http.get_user"] = await measure_async(
+                _get_user, iterations, concurrency
+            )
+
+            hot_id = ids[0]
+
+            async def _get_user_hot(i):
+                await _check(await client.get(f"/users/{hot_id}"))
+
+            results["http.get_user_hot"] = await measure_async(
+                _get_user_hot, iterations, concurrency
+            )
+
+            async def _list_users(i):
+                params = {
+                    "limit": PAGE_SIZE,
+                    "cursor": encode_cursor(rnd.choice(ids))
+                }
+                await _check(await client.get("/users/", params=params))
+
+            results["http.list_users"] = await measure_async(
+                _list_users, iterations, concurrency
+            )
+
+            payloads = []
+            for i in range(iterations):
+                data = unique_user(fake, f"http{i}")
+                data["birthdate"] = data["birthdate"].isoformat()
+                payloads.append(data)
+            created = []
+
+            async def _create(i):
+                response = await client.post("/users/", json=payloads[i])
+                await _check(response)
+                created.append(response.json()["data"]["id"])
+
+            results["http.create_user"] = await measure_async(
+                _create, iterations, concurrency
+            )
+
+            async def _update(i):
+                await _check(await client.put(
+                    f"/users/{created[i]}", json={"first_name": f"Bench{i}"}
+                ))
+
+            results["http.update_user"] = await measure_async(
+                _update, iterations, concurrency
+            )
+
+            async def _delete(i):
+                await _check(await client.delete(f"/users/{created[i]}"))
+
+            results["http.delete_user"] = await measure_async(
+                _delete, iterations, concurrency
+            )
+
+            async def _export(i):
+                await _check(await client.get("/users/export"))
+
+            results["http.export_ndjson"] = await measure_async(_export, 1, 1)
+    finally:
+        app.dependency_overrides.clear()
+
+    return results
+
+
+def run_size(size: int, args, workdir: Path) -> Dict[str, dict]:
+    fake = Faker()
+    Faker.seed(size)
+
+    db_path = workdir / f"bench-{size}.sqlite"
+    # Same pool and PRAGMAs as the application engine
+    engine = create_db_engine(f"sqlite:///{db_path}")
+    migrate(engine)
+    session_factory = sessionmaker(
+        autoflush=False, expire_on_commit=False, bind=engine
+    )
+
+    try:
+        start = time.perf_counter()
+        ids = [i for i in seed(session_factory, size, fake) if i is not None]
+        print(f"[{size}] seeded {len(ids)} users in "
+              f"{time.perf_counter() - start:.1f}s")
+
+        results = bench_operations(session_factory, ids, fake, args.iterations)
+        results.update(asyncio.run(bench_endpoints(
+            session_factory, ids, fake, args.iterations, args.concurrency
+        )))
+    finally:
+        engine.dispose()
+
+    return results
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    metric: str,
+    threshold: float
+) -> List[str]:
+    """
+    Lists the scenarios whose metric grew over the baseline by more than
+    the threshold (e.g. 0.2 for 20%)
+    """
+    regressions = []
+    for size, scenarios in results["results"].items():
+        for name, stats in scenarios.items():
+            base = baseline.get("results", {}).get(size, {}).get(name)
+            if not base or not base.get(metric):
+                continue
+            ratio = stats[metric] / base[metric]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    f"{size} {name}: {metric} {base[metric]:.3f} -> "
+                    f"{stats[metric]:.3f} (+{(ratio - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def print_table(results: dict):
+    print(f"{'size':>8} {'scenario':<26} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'ops/s':>10} {'rss MB':>8}")
+    for size, scenarios in results["results"].items():
+        for name, s in scenarios.items():
+            print(f"{size:>8} {name:<26} {s['p50_ms']:>9.3f} "
+                  f"{s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f} "
+                  f"{s['ops_per_s']:>10.1f} {s['peak_rss_mb']:>8.1f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000],
+        help="Number of seeded users, one database per size"
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument(
+        "--concurrency", type=int, default=1,
+        help="Concurrent clients for the endpoint scenarios"
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--metric", default="p50_ms")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25,
+        help="Allowed relative growth over the baseline"
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true",
+        help="Store these results as the new baseline"
+    )
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            results["results"][str(size)] = run_size(size, args, Path(workdir))
+
+    print_table(results)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline updated at {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        print("No baseline to compare against")
+        return 0
+
+    regressions = compare(
+        results,
+        json.loads(baseline_path.read_text()),
+        args.metric,
+        args.threshold
+    )
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
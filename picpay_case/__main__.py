@@ -0,0 +1,3 @@
+from picpay_case.server import serve
+
+serve()
@@ -0,0 +1,103 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from picpay_case.api.middleware.admission import AdmissionSlot
+from picpay_case.core.config import settings
+from picpay_case.core.notifier import user_changes
+from picpay_case.models.user import User
+from picpay_case.models.user_change import UserChange
+from picpay_case.operations.async_user import AwaitableUserOperations
+from picpay_case.schemas.user import (
+    UserChangeResponse, user_change_list_adapter
+)
+
+Changes = List[Tuple[UserChange, Optional[User]]]
+
+
+def change_responses(changes: Changes) -> List[UserChangeResponse]:
+    return user_change_list_adapter.validate_python(
+        [
+            {
+                "id": change.id,
+                "user_id": change.user_id,
+                "operation": change.operation,
+                "changed_at": change.changed_at,
+                "user": user,
+            }
+            for change, user in changes
+        ],
+        from_attributes=True
+    )
+
+
+def sse_event(change: UserChangeResponse) -> bytes:
+    """
+    Server-Sent Event of a change, its ID is the cursor a reconnecting
+    client sends back as Last-Event-ID
+    """
+    return (
+        f"id: {change.id}\nevent: change\n"
+        f"data: {change.model_dump_json()}\n\n"
+    ).encode()
+
+
+async def check_cursor(user_op: AwaitableUserOperations, since: int):
+    """
+    Raises a 410 when the changes after `since` were partly dropped by the
+    compaction. The detail carries the latest cursor to resume from after
+    resynchronizing the users.
+    """
+    horizon, latest = await user_op.get_change_cursors()
+    if since < horizon:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail={
+                "message": "Changes after this cursor were compacted, "
+                           "resync the users and continue from `cursor`.",
+                "cursor": str(latest),
+            }
+        )
+
+
+async def poll_changes(
+    user_op: AwaitableUserOperations,
+    since: int,
+    limit: int,
+    wait: float,
+    slot: Optional[AdmissionSlot] = None
+) -> Changes:
+    """
+    Returns the changes after `since`, waiting up to `wait` seconds for one
+    to happen. Writes of this process wake the wait, the feed is re-read
+    every CHANGE_FEED_POLL_INTERVAL seconds for the writes of others.
+
+    The admission `slot` of the request is only held while the feed is
+    read. When it can't be taken back the service is overloaded: the feed
+    is read again at the next interval, and the poll ends empty past
+    `wait`.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        if slot is None or await slot.acquire():
+            changes = await user_op.get_changes(since, limit)
+            remaining = deadline - loop.time()
+            if changes or remaining <= 0:
+                return changes
+            # No pooled connection nor admission slot is held while waiting
+            await user_op.close()
+            if slot is not None:
+                slot.release()
+            await user_changes.wait(
+                min(remaining, settings.change_feed_poll_interval)
+            )
+            continue
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return []
+        await asyncio.sleep(
+            min(remaining, settings.change_feed_poll_interval)
+        )
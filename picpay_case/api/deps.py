@@ -1,11 +1,34 @@
 from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from picpay_case.database import get_db
+from picpay_case.core.config import settings
+from picpay_case.database import get_db, get_async_db
 from picpay_case.operations.user import UserOperations
+from picpay_case.operations.async_user import (
+    AsyncUserOperations, ThreadPoolUserOperations
+)
 
 
-def get_user_operations(db: Session = Depends(get_db)):
+def get_sync_user_operations(db: Session = Depends(get_db)):
     """
-    Manage dependencies to get and instance of UserCRUD
+    Manage dependencies to get an instance of UserOperations running on the
+    threadpool
     """
-    return UserOperations(db)
+    return ThreadPoolUserOperations(UserOperations(db))
+
+
+async def get_async_user_operations(
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Manage dependencies to get an instance of UserOperations running on an
+    AsyncSession
+    """
+    return AsyncUserOperations(db)
+
+
+# Selected once at import time from the ASYNC_DB setting
+get_user_operations = (
+    get_async_user_operations if settings.async_db
+    else get_sync_user_operations
+)
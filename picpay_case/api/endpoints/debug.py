@@ -0,0 +1,31 @@
+from fastapi import APIRouter, status
+from picpay_case.core.config import settings
+from picpay_case.core.profiler import profiler
+
+# Only included by main.py when the profiler is enabled
+router = APIRouter(prefix="/debug")
+
+
+@router.get("/profiler")
+def profiler_report():
+    """
+    Endpoint for the statements seen by the query profiler, ordered by
+    their cumulative time, with the slow queries and the flagged patterns
+    """
+    return profiler.snapshot()
+
+
+@router.post("/profiler/dump")
+def profiler_dump():
+    """
+    Endpoint for writing the profiler report to PROFILER_DUMP_PATH
+    """
+    return {"path": profiler.dump(settings.profiler_dump_path)}
+
+
+@router.delete("/profiler", status_code=status.HTTP_204_NO_CONTENT)
+def profiler_reset():
+    """
+    Endpoint for clearing the statistics collected by the profiler
+    """
+    profiler.reset()
@@ -1,95 +1,424 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from picpay_case.schemas.user import UserResponse, UserCreate, UserUpdate
-from picpay_case.operations.user import UserOperations
+from typing import Annotated, List, Literal, Optional
+from fastapi import (
+    APIRouter, Body, Depends, Query, Request, status, HTTPException
+)
+from fastapi.responses import StreamingResponse
+from picpay_case.core.config import settings
+from picpay_case.schemas.user import (
+    UserResponse, UserCreate, UserUpdate, UserBulkCreateResult, UserListQuery,
+    UserBulkSelection, UserBulkUpdate, UserBulkWriteResult, UserChangeResponse,
+    user_list_adapter
+)
+from picpay_case.operations.user import (
+    UserConflictError, UserSearchUnavailableError
+)
+from picpay_case.operations.async_user import AwaitableUserOperations
 from picpay_case.api.deps import get_user_operations
+from picpay_case.api.pagination import encode_cursor, decode_cursor
+from picpay_case.api.projection import (
+    parse_fields, project, project_all, with_fields
+)
+from picpay_case.api.export import csv_chunks, ndjson_chunks
+from picpay_case.api.changes import (
+    change_responses, check_cursor, poll_changes, sse_event
+)
+from picpay_case.api.conditional import (
+    cache_headers, is_not_modified, make_etag, not_modified_response
+)
+from picpay_case.api.formats import NegotiatedRoute, response_format
+from picpay_case.api.responses import envelope_response
+
+from picpay_case.schemas.response import APIResponse
+
+router = APIRouter(prefix="/users", route_class=NegotiatedRoute)
+
+# Seconds between keep-alive comments of an idle change stream
+SSE_HEARTBEAT = 15.0
+
+
+def _page_etag(params: UserListQuery, count, last_update, id_sum) -> str:
+    query = params.model_dump_json(exclude_none=True)
+    return make_etag(
+        query, response_format.get(), count, last_update, id_sum
+    )
+
+
+@router.get("/", response_model=APIResponse[List[UserResponse]])
+async def list_users(
+    request: Request,
+    params: Annotated[UserListQuery, Query()],
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
+):
+    """
+    Endpoint for listing and searching the users in the database, one page
+    at a time. Pass the returned `next_cursor` back as `cursor` (with the
+    same filters and sort) to get the next page.
+    """
+    after_id, after_value = decode_cursor(params.cursor, params.sort)
+    fields = parse_fields(params.fields)
+    sort_field = params.sort.lstrip("-")
+    page = {
+        "limit": params.limit + 1,
+        "after_id": after_id,
+        "filters": params,
+        "sort": params.sort,
+        "after_value": after_value,
+    }
+
+    try:
+        # Conditional requests are answered from an aggregate over the page
+        # (count, last update, sum of the IDs) before loading any row
+        if "if-none-match" in request.headers:
+            stats = await user_op.get_users_page_stats(**page)
+            etag = _page_etag(params, *stats)
+            if is_not_modified(request, etag):
+                return not_modified_response(etag)
+
+        # Fetch one extra row to know whether there is a next page
+        columns = None
+        if fields is not None:
+            columns = with_fields(fields, "id", "updated_at", sort_field)
+        users = await user_op.get_users(**page, fields=columns)
+    except UserSearchUnavailableError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Full-text search is not available."
+        )
+
+    etag = _page_etag(
+        params,
+        len(users),
+        max((u.updated_at for u in users), default=None),
+        sum(u.id for u in users) if users else None
+    )
 
-from picpay_case.schemas.response import (
-    success_response
+    next_cursor = None
+    if len(users) > params.limit:
+        users = users[:params.limit]
+        last = users[-1]
+        next_cursor = encode_cursor(
+            last.id, params.sort, getattr(last, sort_field)
+        )
+
+    if fields is not None:
+        user_response = project_all(users, fields)
+    else:
+        user_response = user_list_adapter.validate_python(
+            users, from_attributes=True
+        )
+    return envelope_response(
+        user_response, next_cursor=next_cursor, headers=cache_headers(etag)
+    )
+
+
+@router.get("/export")
+async def export_users(
+    format: Literal["ndjson", "csv"] = "ndjson",  # pylint: disable=W0622
+    chunk_size: int = Query(
+        default=settings.export_chunk_size, ge=1, le=settings.page_size_max
+    ),
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
+):
+    """
+    Endpoint for streaming every user in the database as NDJSON or CSV.
+    Rows are read and serialized chunk by chunk while the response is sent.
+    """
+    serializer, media_type = {
+        "ndjson": (ndjson_chunks, "application/x-ndjson"),
+        "csv": (csv_chunks, "text/csv"),
+    }[format]
+
+    async def stream():
+        try:
+            async for chunk in serializer(user_op.iter_users(chunk_size)):
+                yield chunk
+        finally:
+            # The request session is closed before streaming starts, so
+            # release the connection the export reopened
+            await user_op.close()
+
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="users.{format}"'
+        }
+    )
+
+
+@router.get(
+    "/changes", response_model=APIResponse[List[UserChangeResponse]]
 )
+async def list_changes(
+    request: Request,
+    since: int = Query(default=0, ge=0),
+    limit: int = Query(
+        default=settings.page_size_default,
+        ge=1, le=settings.change_feed_max_limit
+    ),
+    wait: float = Query(default=0, ge=0, le=settings.change_feed_max_wait),
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
+):
+    """
+    Endpoint for the change feed: the creates, updates and deletes after
+    the `since` cursor, in order, with the current state of each user.
+    With `wait` the request is held up to that many seconds until a change
+    happens (long-poll). Continue from the returned `next_cursor`.
+    """
+    await check_cursor(user_op, since)
+    changes = await poll_changes(
+        user_op, since, limit, wait, request.scope.get("admission_slot")
+    )
 
-router = APIRouter(prefix="/users")
+    next_cursor = str(changes[-1][0].id) if changes else str(since)
+    # An idle poll is an empty list, not the legacy empty object
+    return envelope_response(
+        change_responses(changes), next_cursor=next_cursor, empty=[]
+    )
 
 
-@router.get("/")
-def list_users(
-    user_op: UserOperations = Depends(get_user_operations)
+@router.get("/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(default=None, ge=0),
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
 ):
     """
-    Endpoint for listing all of the users in the database
+    Endpoint streaming the change feed as Server-Sent Events, starting
+    after `since` or the Last-Event-ID of a reconnecting client
     """
-    users = user_op.get_users()
-    user_response = [UserResponse.model_validate(u) for u in users]
-    return success_response(user_response)
+    if since is None:
+        last_event_id = request.headers.get("last-event-id", "")
+        since = int(last_event_id) if last_event_id.isdigit() else 0
+    await check_cursor(user_op, since)
+    slot = request.scope.get("admission_slot")
+
+    async def stream():
+        cursor = since
+        try:
+            while True:
+                changes = await poll_changes(
+                    user_op, cursor, settings.change_feed_max_limit,
+                    SSE_HEARTBEAT, slot
+                )
+                # The client reads the events at its own pace
+                if slot is not None:
+                    slot.release()
+                if not changes:
+                    yield b": keep-alive\n\n"
+                    continue
+                for change in change_responses(changes):
+                    yield sse_event(change)
+                cursor = changes[-1][0].id
+        finally:
+            await user_op.close()
 
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-@router.get("/{user_id}")
-def get_user(
+
+@router.get("/{user_id}", response_model=APIResponse[UserResponse])
+async def get_user(
     user_id: int,
-    user_op: UserOperations = Depends(get_user_operations)
+    request: Request,
+    fields: Optional[str] = Query(
+        default=None, description="Comma separated fields to return"
+    ),
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
 ):
     """
     Endoint for retrieving information for a single user based on the ID
     """
-    user = user_op.get_user(user_id)
+    fields = parse_fields(fields)
+    columns = None
+    if fields is not None:
+        columns = with_fields(fields, "id", "updated_at")
+    user = await user_op.get_user(user_id, fields=columns)
     if not user:
         raise HTTPException(
             status_code=404, detail=f"User  #{user_id} not found"
         )
-    user_response = UserResponse.model_validate(user)
-    return success_response(user_response)
 
+    etag = make_etag(
+        user.id, user.updated_at.isoformat(), response_format.get(),
+        *(fields or ())
+    )
+    if is_not_modified(request, etag, user.updated_at):
+        return not_modified_response(etag, user.updated_at)
+
+    if fields is not None:
+        user_response = project(user, fields)
+    else:
+        user_response = UserResponse.model_validate(user)
+    return envelope_response(
+        user_response, headers=cache_headers(etag, user.updated_at)
+    )
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-def add_user(
+
+@router.post(
+    "/",
+    status_code=status.HTTP_201_CREATED,
+    response_model=APIResponse[UserResponse]
+)
+async def add_user(
     user_data: UserCreate,
-    user_op: UserOperations = Depends(get_user_operations)
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
 ):
     """
     Endpoint for adding a new user to the database
     """
-    user = user_op.create_user(user_data)
+    user = await user_op.create_user(user_data)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="A user with this email already exists."
         )
     user_response = UserResponse.model_validate(user)
-    return success_response(
+    return envelope_response(
         data=user_response,
-        message=f"User {user.email} created with id {user.id}"
+        message=f"User {user.email} created with id {user.id}",
+        status_code=status.HTTP_201_CREATED
+    )
+
+
+@router.post(
+    "/bulk", response_model=APIResponse[List[UserBulkCreateResult]]
+)
+async def add_users(
+    users_data: List[UserCreate] = Body(
+        min_length=1, max_length=settings.bulk_max_items
+    ),
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
+):
+    """
+    Endpoint for adding many users at once. Returns one result per input
+    entry, either created (with its new id) or conflicting on the email.
+    """
+    try:
+        ids = await user_op.create_users(users_data)
+    except UserConflictError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Emails were taken while creating the users, retry."
+        )
+
+    results = [
+        UserBulkCreateResult(
+            index=i,
+            email=u.email,
+            status="created" if user_id is not None else "conflict",
+            id=user_id
+        )
+        for i, (u, user_id) in enumerate(zip(users_data, ids))
+    ]
+    created = sum(user_id is not None for user_id in ids)
+    return envelope_response(
+        data=results,
+        message=f"{created} users created, {len(ids) - created} conflicting"
+    )
+
+
+def _bulk_write_result(
+    selection: UserBulkSelection,
+    ids: List[int]
+) -> UserBulkWriteResult:
+    return UserBulkWriteResult(
+        count=len(ids), ids=ids if selection.return_ids else None
+    )
+
+
+@router.patch("/bulk", response_model=APIResponse[UserBulkWriteResult])
+async def update_users(
+    payload: UserBulkUpdate,
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
+):
+    """
+    Endpoint for applying the same changes to many users, selected by their
+    IDs or by the listing filters, in set-based UPDATE statements
+    """
+    try:
+        ids = await user_op.update_users(
+            payload.changes, user_ids=payload.ids, filters=payload.filter
+        )
+    except UserConflictError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A user with this email already exists."
+        )
+    except UserSearchUnavailableError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Full-text search is not available."
         )
+    return envelope_response(
+        data=_bulk_write_result(payload, ids),
+        message=f"{len(ids)} users updated"
+    )
 
 
-@router.put("/{user_id}")
-def update_user(
+@router.delete("/bulk", response_model=APIResponse[UserBulkWriteResult])
+async def delete_users(
+    payload: UserBulkSelection,
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
+):
+    """
+    Endpoint for deleting many users, selected by their IDs or by the
+    listing filters, in set-based DELETE statements
+    """
+    try:
+        ids = await user_op.delete_users(
+            user_ids=payload.ids, filters=payload.filter
+        )
+    except UserSearchUnavailableError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Full-text search is not available."
+        )
+    return envelope_response(
+        data=_bulk_write_result(payload, ids),
+        message=f"{len(ids)} users deleted"
+    )
+
+
+@router.put("/{user_id}", response_model=APIResponse[UserResponse])
+async def update_user(
     user_id: int,
     user_data: UserUpdate,
-    user_op: UserOperations = Depends(get_user_operations)
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
 ):
     """
     Endpoing for updating a user in the database with the their ID
     """
-    user = user_op.update_user(user_id, user_data)
+    try:
+        user = await user_op.update_user(user_id, user_data)
+    except UserConflictError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A user with this email already exists."
+        )
     if not user:
         raise HTTPException(
             status_code=404, detail=f"User #{user_id} not found"
         )
     user_response = UserResponse.model_validate(user)
-    return success_response(
+    return envelope_response(
         data=user_response,
         message=f"User #{user.id} ({user.email}) Updated"
     )
 
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user(
+async def delete_user(
     user_id: int,
-    user_op: UserOperations = Depends(get_user_operations)
+    user_op: AwaitableUserOperations = Depends(get_user_operations)
 ):
     """
     Endpoint for deleting a user from the database based on their ID
     """
-    is_deleted = user_op.delete_user(user_id)
+    is_deleted = await user_op.delete_user(user_id)
     if not is_deleted:
         raise HTTPException(
             status_code=404, detail=f"User #{user_id} not found"
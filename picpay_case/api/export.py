@@ -0,0 +1,49 @@
+import csv
+import io
+from typing import AsyncIterable, AsyncIterator, List
+
+from picpay_case.models.user import User
+from picpay_case.schemas.user import UserResponse
+
+CSV_COLUMNS = [
+    "id", "first_name", "last_name", "email", "phone", "birthdate",
+    "created_at", "updated_at"
+]
+
+
+async def ndjson_chunks(
+    chunks: AsyncIterable[List[User]]
+) -> AsyncIterator[bytes]:
+    """
+    Serializes each chunk of users as newline delimited JSON
+    """
+    async for chunk in chunks:
+        yield b"".join(
+            UserResponse.model_validate(u).model_dump_json().encode() + b"\n"
+            for u in chunk
+        )
+
+
+async def csv_chunks(
+    chunks: AsyncIterable[List[User]]
+) -> AsyncIterator[bytes]:
+    """
+    Serializes each chunk of users as CSV rows, preceded by the header
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def _flush() -> bytes:
+        out = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return out
+
+    writer.writerow(CSV_COLUMNS)
+    yield _flush()
+
+    async for chunk in chunks:
+        for u in chunk:
+            row = UserResponse.model_validate(u).model_dump(mode="json")
+            writer.writerow([row[c] for c in CSV_COLUMNS])
+        yield _flush()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class ConcurrencyGate:
+    """
+    Admits up to `limit` requests at once. Up to `queue_size` more wait in
+    FIFO order for at most `timeout` seconds; beyond that, or past the
+    deadline, requests are rejected right away.
+    """
+
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # The request went away, a slot handed over meanwhile moves on
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+        # The slot may have been handed over right at the deadline
+        if waiter.done():
+            return True
+        self._waiters.remove(waiter)
+        self.rejected += 1
+        return False
+
+    def release(self):
+        if self._waiters:
+            # The slot goes straight to the next waiter
+            self._waiters.popleft().set_result(None)
+        else:
+            self.active -= 1
+
+
+class AdmissionSlot:
+    """
+    Slot of an admitted request in its gate, handed to the endpoint as
+    `scope["admission_slot"]`. Endpoints that idle (the change feed
+    long-poll) release it while they wait and acquire it again before
+    their next query.
+    """
+
+    def __init__(self, gate: ConcurrencyGate):
+        self.gate = gate
+        self.held = True
+
+    async def acquire(self) -> bool:
+        if not self.held:
+            self.held = await self.gate.acquire()
+        return self.held
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.gate.release()
+
+
+class TokenBuckets:
+    """
+    Rate limit per client: each bucket holds up to `burst` tokens and
+    refills at `rate` tokens per second. Buckets of the least recently seen
+    clients are dropped beyond `max_clients`.
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = \
+            OrderedDict()
+
+    def take(self, client: str) -> float:
+        """
+        Takes a token from the client's bucket. Returns 0 when it had one,
+        otherwise the seconds until the next token.
+        """
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            self.limited += 1
+            wait = (1 - tokens) / self.rate
+
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """
+    Concurrency limits of the database bound routes, one gate for reads
+    and one for writes, plus optional rate limits per client. Clients are
+    identified by `client_header`, or by their address without it.
+    """
+
+    def __init__(
+        self,
+        read_limit: int,
+        write_limit: int,
+        queue_size: int = 100,
+        queue_timeout: float = 1.0,
+        retry_after: int = 1,
+        rate: float = 0,
+        burst: int = 0,
+        client_header: Optional[str] = None
+    ):
+        self.gates: Dict[str, ConcurrencyGate] = {
+            "read": ConcurrencyGate(read_limit, queue_size, queue_timeout),
+            "write": ConcurrencyGate(write_limit, queue_size, queue_timeout),
+        }
+        self.retry_after = retry_after
+        self.buckets = (
+            TokenBuckets(rate, max(1, burst or math.ceil(rate)))
+            if rate > 0 else None
+        )
+        self.client_header = client_header
+
+    def client_key(self, scope) -> str:
+        if self.client_header:
+            key = Headers(scope=scope).get(self.client_header)
+            if key:
+                return key
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    def stats(self) -> Dict[Tuple[str, str], int]:
+        stats = {}
+        for route_class, gate in self.gates.items():
+            stats[(route_class, "active")] = gate.active
+            stats[(route_class, "queued")] = gate.queued
+            stats[(route_class, "rejected")] = gate.rejected
+        if self.buckets is not None:
+            stats[("client", "rate_limited")] = self.buckets.limited
+        return stats
+
+
+async def _reject(send, status: int, retry_after: float, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting the requests of `prefix` through the
+    controller. Rejected requests get a 503 (or a 429 when the client is
+    over its rate) with Retry-After, before they take a thread or a
+    connection. Paths outside the prefix (health checks, metrics) are
+    never limited. Admitted requests find their slot in the scope
+    (AdmissionSlot).
+    """
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        prefix: str = "/users"
+    ):
+        self.app = app
+        self.controller = controller
+        self.prefix = prefix
+
+    def _is_limited(self, path: str) -> bool:
+        return path == self.prefix or path.startswith(self.prefix + "/")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_limited(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        if controller.buckets is not None:
+            wait = controller.buckets.take(controller.client_key(scope))
+            if wait:
+                await _reject(send, 429, wait, "Too many requests.")
+                return
+
+        route_class = "read" if scope["method"] in READ_METHODS else "write"
+        gate = controller.gates[route_class]
+        if not await gate.acquire():
+            await _reject(
+                send, 503, controller.retry_after,
+                "The service is overloaded, retry later."
+            )
+            return
+        slot = scope["admission_slot"] = AdmissionSlot(gate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            slot.release()
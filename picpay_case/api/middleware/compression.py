@@ -0,0 +1,205 @@
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from picpay_case.core.config import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+# Media types worth compressing. Server-Sent Events are left alone, each
+# event has to reach the client as soon as it is sent.
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/msgpack", "text/"
+)
+UNCOMPRESSIBLE_TYPES = ("text/event-stream",)
+
+
+class _Gzip:
+    def __init__(self):
+        self._obj = zlib.compressobj(
+            settings.compression_gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self):
+        self._obj = brotli.Compressor(
+            quality=settings.compression_brotli_quality
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._obj.process(data) + self._obj.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._obj = zstandard.ZstdCompressor(
+            level=settings.compression_zstd_level
+        ).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data) + self._obj.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self, data: bytes = b"") -> bytes:
+        return self._obj.compress(data) + self._obj.flush()
+
+
+def available_encoders() -> Dict[str, Callable]:
+    """
+    Encoders by content-coding, in the order the server prefers them
+    """
+    encoders = {}
+    if zstandard is not None:
+        encoders["zstd"] = _Zstd
+    if brotli is not None:
+        encoders["br"] = _Brotli
+    encoders["gzip"] = _Gzip
+    return encoders
+
+
+def choose_encoding(
+    accept_encoding: str,
+    encodings: List[str]
+) -> Optional[str]:
+    """
+    Picks the content-coding with the highest q-value in Accept-Encoding,
+    ties going to the first of `encodings`. Returns None for identity.
+    """
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    best, best_q = None, 0.0
+    for coding in encodings:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with the best content-coding the
+    client accepts. Complete bodies are compressed when they have at least
+    `minimum_size` bytes, streamed bodies chunk by chunk (each chunk is
+    flushed, so the client never waits for the rest of the stream).
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoders = available_encoders()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(
+            Headers(scope=scope).get("accept-encoding", ""),
+            list(self.encoders)
+        )
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder = None
+        passthrough = False
+
+        async def _send(message):
+            nonlocal start_message, encoder, passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "")
+                passthrough = (
+                    "content-encoding" in headers
+                    or not media_type.startswith(COMPRESSIBLE_TYPES)
+                    or media_type.startswith(UNCOMPRESSIBLE_TYPES)
+                )
+                if passthrough:
+                    await send(message)
+                else:
+                    # Held until the first body chunk shows its size
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(raw=start["headers"])
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                encoder = self.encoders[encoding]()
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                # The compressed bytes differ from the identity ones
+                etag = headers.get("etag")
+                if etag is not None and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                if more_body:
+                    del headers["Content-Length"]
+                    start["headers"] = headers.raw
+                    await send(start)
+                else:
+                    body = encoder.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                    start["headers"] = headers.raw
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+            if more_body:
+                data = encoder.compress(body) if body else b""
+            else:
+                data = encoder.finish(body)
+            if data or not more_body:
+                await send({
+                    "type": "http.response.body",
+                    "body": data,
+                    "more_body": more_body
+                })
+
+        await self.app(scope, receive, _send)
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from picpay_case.core.cache import CacheBackend
+
+IDEMPOTENT_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+MAX_KEY_LENGTH = 255
+# Outcomes a retry should run again instead of replaying
+RETRYABLE_STATUSES = frozenset({408, 425, 429})
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+
+async def _send_json(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """
+    ASGI middleware for the Idempotency-Key header of write requests. The
+    first response for a key (status, headers and body) is kept in
+    `store` once the request finishes, and retries with the same key,
+    method and path get it back without running the endpoint again. With
+    a shared store (IdempotencyStore) that holds across workers. A retry
+    reaching the same worker while the first request is still running
+    waits for its result. The store is called from the threadpool, it may
+    block on I/O.
+
+    A key reused with another body gets a 422. Server errors and
+    throttling responses aren't stored, their retries run again.
+    """
+
+    def __init__(self, app, store: CacheBackend):
+        self.app = app
+        self.store = store
+        self.replayed = 0
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or \
+                scope["method"] not in IDEMPOTENT_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        key = Headers(scope=scope).get("idempotency-key")
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_json(
+                send, 400,
+                f"Idempotency-Key must have 1 to {MAX_KEY_LENGTH} characters"
+            )
+            return
+
+        body = await _read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        store_key = (scope["method"], scope["path"], key)
+
+        while True:
+            stored = await run_in_threadpool(self.store.get, store_key)
+            if stored is not None:
+                await self._replay(stored, fingerprint, send)
+                return
+
+            inflight = self._inflight.get(store_key)
+            if inflight is None:
+                break
+            # The first request decides, a failed one lets the next run
+            await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[store_key] = future
+        try:
+            response = await self._run(scope, receive, send, body)
+            if response is not None:
+                await run_in_threadpool(
+                    self.store.set,
+                    store_key, StoredResponse(fingerprint, *response)
+                )
+        finally:
+            del self._inflight[store_key]
+            future.set_result(None)
+
+    async def _run(
+        self,
+        scope,
+        receive,
+        send,
+        body: bytes
+    ) -> Optional[tuple]:
+        """
+        Runs the request with its buffered body and returns its status,
+        headers and body when it may be replayed
+        """
+        start = {}
+        chunks = []
+        body_sent = False
+
+        async def _receive():
+            nonlocal body_sent
+            if body_sent:
+                # Only the disconnect is left to receive
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, _receive, _send)
+
+        status = start.get("status", 500)
+        if status >= 500 or status in RETRYABLE_STATUSES:
+            return None
+        return status, list(start.get("headers", [])), b"".join(chunks)
+
+    async def _replay(self, stored: StoredResponse, fingerprint: str, send):
+        if stored.fingerprint != fingerprint:
+            await _send_json(
+                send, 422,
+                "Idempotency-Key was already used with another request body"
+            )
+            return
+        self.replayed += 1
+        await send({
+            "type": "http.response.start",
+            "status": stored.status,
+            "headers": stored.headers + [(b"idempotent-replayed", b"true")],
+        })
+        await send({"type": "http.response.body", "body": stored.body})
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
@@ -0,0 +1,67 @@
+import time
+
+from starlette.routing import Match
+
+from picpay_case.core.metrics import (
+    MetricsRegistry, RequestStats, metrics, request_stats
+)
+
+
+def _route_template(scope) -> str:
+    # The router stores the matched route in the scope, labelling by its
+    # template keeps the number of series bounded
+    route = scope.get("route")
+    if route is None:
+        # Requests answered before routing (e.g. shed by the admission
+        # control) are labelled by the route they were sent to, with or
+        # without the trailing slash like the router's redirect
+        path = scope["path"]
+        other = path[:-1] if path.endswith("/") else path + "/"
+        routes = getattr(scope.get("app"), "routes", ())
+        route = next((
+            candidate
+            for candidate_scope in (scope, {**scope, "path": other})
+            for candidate in routes
+            if candidate.matches(candidate_scope)[0] == Match.FULL
+        ), None)
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording count, status and latency of each request by
+    route template, together with the SQL work done while serving it
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+
+        async def _send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.registry.in_progress += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            duration = time.perf_counter() - start
+            self.registry.in_progress -= 1
+            request_stats.reset(token)
+
+            self.registry.observe_request(
+                scope["method"], _route_template(scope), status_code,
+                duration, stats
+            )
@@ -0,0 +1,73 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+# Parses the sort value stored in a cursor back to its column type
+_SORT_VALUE_PARSERS = {
+    "created_at": datetime.fromisoformat,
+    "updated_at": datetime.fromisoformat,
+    "email": str,
+}
+
+
+def _invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid pagination cursor."
+    )
+
+
+def encode_cursor(last_id: int, sort: str = "id", value: Any = None) -> str:
+    """
+    Builds an opaque cursor pointing right after the given user, `value`
+    being its sort column value when not sorting by id
+    """
+    payload = {"id": last_id}
+    if sort != "id":
+        payload["sort"] = sort
+    if sort.lstrip("-") != "id":
+        payload["value"] = (
+            value.isoformat() if isinstance(value, datetime) else value
+        )
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(
+    cursor: Optional[str],
+    sort: str = "id"
+) -> Tuple[Optional[int], Any]:
+    """
+    Reads the (user id, sort value) stored in a cursor, raising a 400 if it
+    was tampered or built for another sort
+    """
+    if not cursor:
+        return None, None
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        last_id = payload["id"]
+        cursor_sort = payload.get("sort", "id")
+    except (binascii.Error, ValueError, KeyError, TypeError, AttributeError):
+        raise _invalid_cursor()
+
+    if not isinstance(last_id, int) or isinstance(last_id, bool) \
+            or cursor_sort != sort:
+        raise _invalid_cursor()
+
+    field = sort.lstrip("-")
+    if field == "id":
+        return last_id, None
+
+    value = payload.get("value")
+    if not isinstance(value, str):
+        raise _invalid_cursor()
+    try:
+        return last_id, _SORT_VALUE_PARSERS[field](value)
+    except ValueError:
+        raise _invalid_cursor()
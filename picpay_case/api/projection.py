@@ -0,0 +1,45 @@
+from typing import Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from picpay_case.schemas.user import UserResponse
+
+USER_FIELDS = tuple(UserResponse.model_fields)
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Reads a comma separated `fields` parameter (e.g. "id,email"), None
+    meaning every field. Raises a 400 on unknown fields.
+    """
+    if fields is None:
+        return None
+
+    names = tuple(dict.fromkeys(
+        name.strip() for name in fields.split(",") if name.strip()
+    ))
+    unknown = [name for name in names if name not in USER_FIELDS]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid fields {unknown or fields!r}, "
+                   f"expected some of: {', '.join(USER_FIELDS)}."
+        )
+    return names
+
+
+def with_fields(fields: Tuple[str, ...], *required: str) -> Tuple[str, ...]:
+    """
+    The columns to load for a projection: the requested fields plus the
+    ones the endpoint itself needs (ETags, cursors)
+    """
+    return tuple(dict.fromkeys((*fields, *required)))
+
+
+def project(row, fields: Iterable[str]) -> dict:
+    return {name: getattr(row, name) for name in fields}
+
+
+def project_all(rows, fields: Iterable[str]) -> List[dict]:
+    fields = tuple(fields)
+    return [project(row, fields) for row in rows]
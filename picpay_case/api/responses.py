@@ -0,0 +1,34 @@
+from typing import Any, Dict, Optional
+
+from fastapi import Response, status
+
+from picpay_case.api.formats import MSGPACK, packb, response_format
+from picpay_case.schemas.response import success_dict, success_json
+
+
+def envelope_response(
+    data=None,
+    message: Optional[str] = None,
+    next_cursor: Optional[str] = None,
+    status_code: int = status.HTTP_200_OK,
+    headers: Optional[Dict[str, str]] = None,
+    empty: Any = {}
+) -> Response:
+    """
+    Builds the response for the standard API envelope, in the format
+    negotiated for the request. The body is rendered once to bytes, FastAPI
+    doesn't validate or encode it again. Empty data is sent as `empty`.
+    """
+    media_type = response_format.get()
+    if media_type == MSGPACK:
+        content = packb(success_dict(data, message, next_cursor, empty))
+    else:
+        content = success_json(
+            data, message=message, next_cursor=next_cursor, empty=empty
+        )
+    return Response(
+        content=content,
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
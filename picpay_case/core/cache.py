@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class CacheBackend:
+    """
+    Storage interface of the caches. A shared cache (e.g. Redis) can be
+    plugged in by implementing these methods; values are never None.
+    """
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: Hashable, value: Any):
+        raise NotImplementedError
+
+    def delete(self, key: Hashable):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process cache bounded by size (least recently used entries are
+    evicted first) and by age (entries expire `ttl` seconds after set)
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# Result of a load whose loader was cancelled, its waiters load again
+_RETRY = object()
+
+
+class ReadThroughCache:
+    """
+    Read-through cache over a backend. Concurrent misses for the same key
+    are coalesced into a single load (single-flight), so a hot key that
+    expires doesn't send a burst of identical queries to the database.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        while True:
+            value = self.backend.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            value = await asyncio.shield(inflight)
+            if value is not _RETRY:
+                return value
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            # Only the loading request went away (e.g. its client
+            # disconnected), the waiters elect a new loader
+            future.set_result(_RETRY)
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            # Only waiters care about the error, don't warn when there are none
+            future.exception()
+            raise
+        finally:
+            # A write invalidating the key during the load replaced or
+            # dropped the in-flight entry, so the result must not be stored
+            is_current = self._inflight.get(key) is future
+            if is_current:
+                del self._inflight[key]
+
+        if is_current and value is not None:
+            self.backend.set(key, value)
+        future.set_result(value)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._inflight.pop(key, None)
+        self.backend.set(key, value)
+
+    def invalidate(self, key: Hashable):
+        self._inflight.pop(key, None)
+        self.backend.delete(key)
+
+    def clear(self):
+        self._inflight.clear()
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self.backend),
+        }
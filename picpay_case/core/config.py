@@ -1,8 +1,222 @@
 import os
+from typing import List, Optional
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 class Settings:
     database_url: str = os.environ.get("DB_URL", "sqlite:///.db.sqlite")
 
+    # Serve requests with an AsyncEngine/AsyncSession instead of threads.
+    # The async URL defaults to the aiosqlite variant of a SQLite DB_URL.
+    async_db: bool = _env_bool("ASYNC_DB", False)
+    async_database_url: str = os.environ.get(
+        "ASYNC_DB_URL",
+        database_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    )
+
+    # Read replicas of DB_URL, comma separated. The reads of a request go
+    # to one replica until the request writes, then to the primary.
+    replica_urls: List[str] = [
+        url.strip()
+        for url in os.environ.get("REPLICA_URLS", "").split(",")
+        if url.strip()
+    ]
+    async_replica_urls: List[str] = [
+        url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        for url in replica_urls
+    ]
+    # Seconds a failing replica is skipped before it is checked again
+    replica_retry_after: float = float(
+        os.environ.get("REPLICA_RETRY_AFTER", 5)
+    )
+
+    # Connection pool (QueuePool databases, e.g. a SQLite file or Postgres)
+    # and compiled statement cache of the engines
+    db_pool_size: int = int(os.environ.get("DB_POOL_SIZE", 5))
+    db_max_overflow: int = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    db_pool_timeout: float = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    db_pool_pre_ping: bool = _env_bool("DB_POOL_PRE_PING", False)
+    db_pool_recycle: int = int(os.environ.get("DB_POOL_RECYCLE", -1))
+    db_query_cache_size: int = int(os.environ.get("DB_QUERY_CACHE_SIZE", 500))
+
+    # PRAGMAs set on every SQLite connection. WAL lets readers run while a
+    # write is in progress, and synchronous=NORMAL is safe with WAL (a power
+    # loss may drop the last commits, never corrupt the database).
+    sqlite_journal_mode: str = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    sqlite_synchronous: str = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    # Negative values are KiB: 64 MiB of page cache per connection
+    sqlite_cache_size: int = int(os.environ.get("SQLITE_CACHE_SIZE", -64000))
+    sqlite_mmap_size: int = int(
+        os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+    )
+    sqlite_busy_timeout_ms: int = int(
+        os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)
+    )
+    sqlite_temp_store: str = os.environ.get("SQLITE_TEMP_STORE", "MEMORY")
+
+    # Threads running the sync endpoints of a worker. Defaults to the most
+    # connections its pool hands out, so no thread waits for a connection.
+    threadpool_size: int = int(
+        os.environ.get("THREADPOOL_SIZE", db_pool_size + db_max_overflow)
+    )
+
+    # Admission control of the /users routes: concurrent reads and writes
+    # per worker (together the connections of the pool by default), with a
+    # bounded queue waiting up to the timeout before a 503.
+    admission_enabled: bool = _env_bool("ADMISSION_ENABLED", True)
+    admission_write_limit: int = int(
+        os.environ.get("ADMISSION_WRITE_LIMIT", max(1, db_pool_size))
+    )
+    admission_read_limit: int = int(
+        os.environ.get(
+            "ADMISSION_READ_LIMIT",
+            max(1, db_pool_size + db_max_overflow - admission_write_limit)
+        )
+    )
+    admission_queue_size: int = int(
+        os.environ.get("ADMISSION_QUEUE_SIZE", 100)
+    )
+    admission_queue_timeout: float = float(
+        os.environ.get("ADMISSION_QUEUE_TIMEOUT", 1)
+    )
+    admission_retry_after: int = int(
+        os.environ.get("ADMISSION_RETRY_AFTER", 1)
+    )
+    # Optional rate limit per client (requests per second, 0 disables),
+    # identified by the header when set, by the address otherwise
+    admission_client_rate: float = float(
+        os.environ.get("ADMISSION_CLIENT_RATE", 0)
+    )
+    admission_client_burst: int = int(
+        os.environ.get("ADMISSION_CLIENT_BURST", 0)
+    )
+    admission_client_header: str = os.environ.get(
+        "ADMISSION_CLIENT_HEADER", ""
+    )
+
+    # Production server (`python -m picpay_case`). The worker count defaults
+    # to the CPUs available to the process; "auto" loop/http pick uvloop and
+    # httptools when they are installed.
+    server_host: str = os.environ.get("SERVER_HOST", "0.0.0.0")
+    server_port: int = int(os.environ.get("SERVER_PORT", 8000))
+    server_workers: Optional[int] = (
+        int(os.environ["SERVER_WORKERS"])
+        if os.environ.get("SERVER_WORKERS") else None
+    )
+    server_loop: str = os.environ.get("SERVER_LOOP", "auto")
+    server_http: str = os.environ.get("SERVER_HTTP", "auto")
+    server_backlog: int = int(os.environ.get("SERVER_BACKLOG", 2048))
+    server_keep_alive: int = int(os.environ.get("SERVER_KEEP_ALIVE", 5))
+    # Restart a worker after this many requests (0 never), finishing the
+    # requests in flight within the graceful timeout
+    server_max_requests: int = int(os.environ.get("SERVER_MAX_REQUESTS", 0))
+    server_graceful_timeout: int = int(
+        os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30)
+    )
+    # One log line per request, on by default like uvicorn
+    server_access_log: bool = _env_bool("SERVER_ACCESS_LOG", True)
+
+    # Apply pending schema migrations when the application starts
+    auto_migrate: bool = _env_bool("AUTO_MIGRATE", True)
+
+    # Response compression (zstd and br when zstandard/brotli are
+    # installed, gzip otherwise) of bodies of at least the minimum size
+    compression_enabled: bool = _env_bool("COMPRESSION_ENABLED", True)
+    compression_min_size: int = int(
+        os.environ.get("COMPRESSION_MIN_SIZE", 1024)
+    )
+    compression_gzip_level: int = int(
+        os.environ.get("COMPRESSION_GZIP_LEVEL", 6)
+    )
+    compression_brotli_quality: int = int(
+        os.environ.get("COMPRESSION_BROTLI_QUALITY", 4)
+    )
+    compression_zstd_level: int = int(
+        os.environ.get("COMPRESSION_ZSTD_LEVEL", 3)
+    )
+
+    # Responses of write requests with an Idempotency-Key, replayed to
+    # their retries. Kept in the database, shared by the workers.
+    idempotency_enabled: bool = _env_bool("IDEMPOTENCY_ENABLED", True)
+    idempotency_ttl: float = float(
+        os.environ.get("IDEMPOTENCY_TTL", 24 * 3600)
+    )
+    # Bounds of the stored responses: rows (the oldest are evicted) and
+    # bytes per body (larger responses aren't stored)
+    idempotency_max_keys: int = int(
+        os.environ.get("IDEMPOTENCY_MAX_KEYS", 10000)
+    )
+    idempotency_max_body_size: int = int(
+        os.environ.get("IDEMPOTENCY_MAX_BODY_SIZE", 64 * 1024)
+    )
+    # Seconds between deletions of the expired keys (0 disables them)
+    idempotency_purge_interval: float = float(
+        os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", 3600)
+    )
+
+    # Request, query and pool metrics exposed on /metrics
+    metrics_enabled: bool = _env_bool("METRICS_ENABLED", True)
+
+    # Opt-in statement profiler, served on /debug/profiler
+    profiler_enabled: bool = _env_bool("PROFILER_ENABLED", False)
+    slow_query_ms: float = float(os.environ.get("SLOW_QUERY_MS", 100))
+    profiler_repeat_threshold: int = int(
+        os.environ.get("PROFILER_REPEAT_THRESHOLD", 5)
+    )
+    profiler_dump_path: str = os.environ.get(
+        "PROFILER_DUMP_PATH", "profiler.json"
+    )
+
+    # Read-through cache of single users (GET /users/{id})
+    cache_enabled: bool = _env_bool("CACHE_ENABLED", True)
+    cache_max_size: int = int(os.environ.get("CACHE_MAX_SIZE", 10000))
+    cache_ttl: float = float(os.environ.get("CACHE_TTL", 60))
+
+    # Pagination for list endpoints
+    page_size_default: int = int(os.environ.get("PAGE_SIZE_DEFAULT", 100))
+    page_size_max: int = int(os.environ.get("PAGE_SIZE_MAX", 1000))
+
+    # Rows read from the database per chunk when exporting users
+    export_chunk_size: int = int(os.environ.get("EXPORT_CHUNK_SIZE", 1000))
+
+    # Maximum number of users accepted by a single bulk request
+    bulk_max_items: int = int(os.environ.get("BULK_MAX_ITEMS", 50000))
+
+    # Change feed (GET /users/changes): maximum batch, long-poll wait and
+    # the interval it re-reads the feed at (for writes of other processes)
+    change_feed_max_limit: int = int(
+        os.environ.get("CHANGE_FEED_MAX_LIMIT", 1000)
+    )
+    change_feed_max_wait: float = float(
+        os.environ.get("CHANGE_FEED_MAX_WAIT", 30)
+    )
+    change_feed_poll_interval: float = float(
+        os.environ.get("CHANGE_FEED_POLL_INTERVAL", 1)
+    )
+    # Changes are kept for the retention (seconds), compacted periodically
+    # by the application (0 disables the compaction)
+    change_feed_retention: float = float(
+        os.environ.get("CHANGE_FEED_RETENTION", 7 * 24 * 3600)
+    )
+    change_feed_compact_interval: float = float(
+        os.environ.get("CHANGE_FEED_COMPACT_INTERVAL", 3600)
+    )
+
+    # Group commit: single-user writes arriving within the window are
+    # applied by one writer in a single transaction
+    group_commit_enabled: bool = _env_bool("GROUP_COMMIT_ENABLED", False)
+    group_commit_window_ms: float = float(
+        os.environ.get("GROUP_COMMIT_WINDOW_MS", 2)
+    )
+    group_commit_max_batch: int = int(
+        os.environ.get("GROUP_COMMIT_MAX_BATCH", 100)
+    )
+
 
 settings = Settings()
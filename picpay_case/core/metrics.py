@@ -0,0 +1,239 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0
+)
+CHECKOUT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0
+)
+
+
+@dataclass
+class RequestStats:
+    """
+    Database work done while serving one request. Filled without locks by
+    the engine events and folded into the registry once the request ends.
+    """
+    statements: int = 0
+    db_time: float = 0.0
+    # Executions per statement fingerprint, filled by the query profiler
+    fingerprints: Dict[str, int] = field(default_factory=dict)
+
+
+# Stats of the request being served in the current context, if any. The
+# threadpool and SQLAlchemy's greenlets copy the context, so the events of
+# a request's queries see the same object.
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+class MetricsRegistry:
+    """
+    Prometheus counters and histograms for requests, queries and the
+    connection pool, rendered in the text exposition format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.db_statements: Dict[Tuple[str, str], int] = {}
+        self.db_time: Dict[Tuple[str, str], float] = {}
+        self.checkout_wait = Histogram(CHECKOUT_BUCKETS)
+        self.in_progress = 0
+        self._gauges: List[tuple] = []
+
+    def register_gauge(
+        self,
+        name: str,
+        help_text: str,
+        collect: Callable[[], Dict[Tuple, float]],
+        label_names: Sequence[str] = ()
+    ):
+        """
+        Adds a gauge read at render time. `collect` returns the current
+        values keyed by their label values (`()` when there are no labels).
+        """
+        self._gauges.append((name, help_text, collect, tuple(label_names)))
+
+    def observe_request(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        duration: float,
+        stats: RequestStats
+    ):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] = \
+                self.requests.get((method, route, status), 0) + 1
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+            self.db_statements[key] = \
+                self.db_statements.get(key, 0) + stats.statements
+            self.db_time[key] = self.db_time.get(key, 0.0) + stats.db_time
+
+    def observe_checkout(self, wait: float):
+        with self._lock:
+            self.checkout_wait.observe(wait)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.latency.clear()
+            self.db_statements.clear()
+            self.db_time.clear()
+            self.checkout_wait = Histogram(CHECKOUT_BUCKETS)
+
+    @staticmethod
+    def _histogram_lines(
+        name: str,
+        label_names: Sequence[str],
+        label_values: Sequence,
+        histogram: Histogram
+    ) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            labels = _labels([*label_names, "le"], [*label_values, bound])
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _labels([*label_names, "le"], [*label_values, "+Inf"])
+        lines.append(f"{name}_bucket{labels} {histogram.count}")
+        labels = _labels(label_names, label_values)
+        lines.append(f"{name}_sum{labels} {histogram.sum}")
+        lines.append(f"{name}_count{labels} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        route_labels = ("method", "route")
+        with self._lock:
+            lines = [
+                "# HELP http_requests_total Requests by route and status",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), count in self.requests.items():
+                labels = _labels(
+                    (*route_labels, "status"), (method, route, status)
+                )
+                lines.append(f"http_requests_total{labels} {count}")
+
+            lines += [
+                "# HELP http_requests_in_progress Requests being served",
+                "# TYPE http_requests_in_progress gauge",
+                f"http_requests_in_progress {self.in_progress}",
+                "# HELP http_request_duration_seconds Request latency",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for key, histogram in self.latency.items():
+                lines += self._histogram_lines(
+                    "http_request_duration_seconds", route_labels, key,
+                    histogram
+                )
+
+            lines += [
+                "# HELP db_statements_total SQL statements run per route",
+                "# TYPE db_statements_total counter",
+            ]
+            for key, count in self.db_statements.items():
+                labels = _labels(route_labels, key)
+                lines.append(f"db_statements_total{labels} {count}")
+
+            lines += [
+                "# HELP db_statement_seconds_total Time spent in SQL per route",
+                "# TYPE db_statement_seconds_total counter",
+            ]
+            for key, total in self.db_time.items():
+                labels = _labels(route_labels, key)
+                lines.append(f"db_statement_seconds_total{labels} {total}")
+
+            lines += [
+                "# HELP db_pool_checkout_seconds Wait for a pool connection",
+                "# TYPE db_pool_checkout_seconds histogram",
+                *self._histogram_lines(
+                    "db_pool_checkout_seconds", (), (), self.checkout_wait
+                ),
+            ]
+
+        for name, help_text, collect, label_names in self._gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for label_values, value in collect().items():
+                labels = _labels(label_names, label_values)
+                lines.append(f"{name}{labels} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def instrument_engine(engine: Engine):
+    """
+    Counts the statements of `engine` and the time spent running them
+    towards the request being served
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get("profiler_explaining"):
+            return
+        elapsed = time.perf_counter() - conn.info["metrics_start"]
+        stats = request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_time += elapsed
+
+
+def instrument_sessions(session_class):
+    """
+    Measures how long sessions wait for a connection: from the start of a
+    transaction (before the connection is acquired from the pool) until the
+    connection begins it
+    """
+
+    @event.listens_for(session_class, "after_transaction_create")
+    def _created(session, transaction):
+        if transaction.parent is None:
+            session.info["metrics_checkout"] = time.perf_counter()
+
+    @event.listens_for(session_class, "after_begin")
+    def _begun(session, transaction, connection):
+        started = session.info.pop("metrics_checkout", None)
+        if started is None:
+            return
+        metrics.observe_checkout(time.perf_counter() - started)
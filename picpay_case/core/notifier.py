@@ -0,0 +1,49 @@
+import asyncio
+import threading
+from typing import Set, Tuple
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ChangeNotifier:
+    """
+    Wakes the coroutines waiting for a change, on whichever event loop they
+    run. Only signals the changes of this process: waiters should still
+    re-check the source periodically.
+    """
+
+    def __init__(self):
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] \
+            = set()
+        self._lock = threading.Lock()
+
+    def notify(self):
+        with self._lock:
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for the next `notify`, returns whether
+        it happened
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+# Writes to the users, waited on by the change feed readers
+user_changes = ChangeNotifier()
@@ -0,0 +1,206 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from picpay_case.core.config import settings
+from picpay_case.core.metrics import request_stats
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+_VALUES_ROWS = re.compile(r"(\((?:\?, )*\?\))(?:, \((?:\?, )*\?\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Normalizes a statement so executions that only differ in literals, IN
+    list or multi-row VALUES lengths are grouped together
+    """
+    normalized = _STRING.sub("?", statement)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _SPACES.sub(" ", normalized).strip()
+    normalized = _IN_LIST.sub("IN (...)", normalized)
+    return _VALUES_ROWS.sub(r"\1, ...", normalized)
+
+
+def is_full_scan(plan: List[str]) -> bool:
+    """
+    Whether an EXPLAIN QUERY PLAN reads a whole table instead of searching
+    an index (e.g. `SCAN users` rather than `SEARCH users USING INDEX`)
+    """
+    return any(
+        detail.startswith("SCAN ")
+        and " USING " not in detail
+        and "CONSTANT ROW" not in detail
+        and "(" not in detail
+        for detail in plan
+    )
+
+
+class StatementStats:
+    def __init__(self, statement: str, sample_size: int):
+        self.statement = statement
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.durations = deque(maxlen=sample_size)
+        self.plan: Optional[List[str]] = None
+        self.full_scan = False
+        self.repeated_requests = 0
+
+    def to_dict(self) -> dict:
+        ordered = sorted(self.durations)
+        p99 = ordered[round(0.99 * (len(ordered) - 1))] if ordered else 0.0
+        return {
+            "statement": self.statement,
+            "calls": self.calls,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.calls * 1000 if self.calls else 0.0,
+            "p99_ms": p99 * 1000,
+            "max_ms": self.max * 1000,
+            "plan": self.plan,
+            "full_scan": self.full_scan,
+            "repeated_requests": self.repeated_requests,
+        }
+
+
+class QueryProfiler:
+    """
+    Statement level profiler built on the engine cursor events. Groups the
+    statements by fingerprint, captures their SQLite query plan, logs the
+    slow ones and flags full table scans and statements repeated many times
+    within the same request (N+1 patterns).
+    """
+
+    def __init__(
+        self,
+        slow_query_ms: float = 100.0,
+        repeat_threshold: int = 5,
+        sample_size: int = 1000,
+        max_slow_queries: int = 100
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.repeat_threshold = repeat_threshold
+        self.sample_size = sample_size
+        self.stats: Dict[str, StatementStats] = {}
+        self.slow_queries = deque(maxlen=max_slow_queries)
+        self._lock = threading.Lock()
+
+    def attach(self, engine: Engine):
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, many):
+            conn.info["profiler_start"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, many):
+            if conn.info.get("profiler_explaining"):
+                return
+            elapsed = time.perf_counter() - conn.info["profiler_start"]
+            self.record(conn, statement, parameters, elapsed, many)
+
+    def _explain(self, conn, statement: str, parameters, many: bool):
+        if conn.dialect.name != "sqlite":
+            return None
+        if many:
+            parameters = parameters[0] if parameters else ()
+
+        conn.info["profiler_explaining"] = True
+        try:
+            rows = conn.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).all()
+        except Exception:  # pylint: disable=broad-except
+            logger.debug("Could not explain %s", statement, exc_info=True)
+            return None
+        finally:
+            conn.info["profiler_explaining"] = False
+        return [row[-1] for row in rows]
+
+    def record(self, conn, statement: str, parameters, elapsed: float,
+               many: bool = False):
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = StatementStats(
+                    key, self.sample_size
+                )
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.durations.append(elapsed)
+            needs_plan = stats.plan is None
+
+        slow = elapsed * 1000 >= self.slow_query_ms
+        if needs_plan or slow:
+            plan = self._explain(conn, statement, parameters, many)
+            if plan is not None:
+                stats.plan = plan
+                stats.full_scan = is_full_scan(plan)
+
+        if slow:
+            entry = {
+                "statement": statement,
+                "duration_ms": elapsed * 1000,
+                "plan": stats.plan,
+                "at": time.time(),
+            }
+            self.slow_queries.append(entry)
+            logger.warning(
+                "Slow query (%.1f ms): %s | plan: %s",
+                entry["duration_ms"], statement, stats.plan
+            )
+
+        request = request_stats.get()
+        if request is not None:
+            count = request.fingerprints.get(key, 0) + 1
+            request.fingerprints[key] = count
+            if count == self.repeat_threshold:
+                stats.repeated_requests += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            statements = [s.to_dict() for s in self.stats.values()]
+        statements.sort(key=lambda s: s["total_ms"], reverse=True)
+        return {
+            "slow_query_ms": self.slow_query_ms,
+            "repeat_threshold": self.repeat_threshold,
+            "statements": statements,
+            "full_scans": [
+                s["statement"] for s in statements if s["full_scan"]
+            ],
+            "repeated_per_request": [
+                s["statement"] for s in statements if s["repeated_requests"]
+            ],
+            "slow_queries": list(self.slow_queries),
+        }
+
+    def dump(self, path: str) -> str:
+        with open(path, "w") as out:
+            json.dump(self.snapshot(), out, indent=2, default=str)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+            self.slow_queries.clear()
+
+
+profiler: Optional[QueryProfiler] = (
+    QueryProfiler(
+        slow_query_ms=settings.slow_query_ms,
+        repeat_threshold=settings.profiler_repeat_threshold
+    )
+    if settings.profiler_enabled else None
+)
@@ -0,0 +1,125 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    """
+    Chooses the engine serving the reads of a session: round-robin over the
+    healthy replicas, or the primary when none is healthy.
+
+    A replica is marked down when one of its statements or connections
+    fails with a database error, skipped for `retry_after` seconds and then
+    probed with `SELECT 1` before serving reads again.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        replicas: Sequence[Engine],
+        retry_after: float = 5.0
+    ):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.retry_after = retry_after
+        self._down: Dict[Engine, float] = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+        for replica in self.replicas:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if isinstance(context.sqlalchemy_exception, DBAPIError):
+            self.mark_down(context.engine)
+
+    def mark_down(self, replica: Engine):
+        with self._lock:
+            if replica not in self._down:
+                logger.warning("Replica %s marked down", replica.url)
+            self._down[replica] = time.monotonic() + self.retry_after
+
+    def is_healthy(self, replica: Engine) -> bool:
+        with self._lock:
+            retry_at = self._down.get(replica)
+        if retry_at is None:
+            return True
+        if time.monotonic() < retry_at:
+            return False
+
+        try:
+            with replica.connect() as conn:
+                conn.exec_driver_sql("SELECT 1")
+        except Exception:  # pylint: disable=broad-except
+            self.mark_down(replica)
+            return False
+
+        with self._lock:
+            self._down.pop(replica, None)
+        logger.info("Replica %s is back up", replica.url)
+        return True
+
+    def choose(self) -> Engine:
+        if not self.replicas:
+            return self.primary
+        start = next(self._turn)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if self.is_healthy(replica):
+                return replica
+        return self.primary
+
+
+def use_primary(session: Session):
+    """
+    Sends every statement of the session to the primary from now on. Write
+    operations read before they write (e.g. the email check of a bulk
+    create), and those reads must not be served by a lagging replica.
+    """
+    session.info["routing_primary"] = True
+
+
+class RoutingSession(Session):
+    """
+    Session that sends its reads to a replica chosen by `router` and its
+    writes to the primary. Once the session writes (or flushes), every
+    following statement goes to the primary too, so a request always
+    reads its own writes. Statements the session can't inspect (e.g.
+    `session.connection()`) also go to the primary.
+    """
+
+    def __init__(self, *args, router: Optional[ReplicaRouter] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.router is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+        if self._flushing or isinstance(clause, UpdateBase) or \
+                (mapper is None and clause is None):
+            self.info["routing_primary"] = True
+        if self.info.get("routing_primary"):
+            return self.router.primary
+
+        replica = self.info.get("routing_replica")
+        if replica is None:
+            replica = self.info["routing_replica"] = self.router.choose()
+        return replica
+
+    def close(self):
+        super().close()
+        # A closed session may be reused for another unit of work
+        self.info.pop("routing_primary", None)
+        self.info.pop("routing_replica", None)
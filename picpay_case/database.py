@@ -1,34 +1,149 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine, async_sessionmaker, create_async_engine
+)
+from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from picpay_case.core.config import settings
+from picpay_case.core.metrics import instrument_engine, instrument_sessions
+from picpay_case.core.profiler import profiler
+from picpay_case.core.replicas import ReplicaRouter, RoutingSession
+
+
+def sqlite_pragmas() -> dict:
+    # busy_timeout goes first so switching the journal mode waits for locks
+    return {
+        "busy_timeout": settings.sqlite_busy_timeout_ms,
+        "journal_mode": settings.sqlite_journal_mode,
+        "synchronous": settings.sqlite_synchronous,
+        "cache_size": settings.sqlite_cache_size,
+        "mmap_size": settings.sqlite_mmap_size,
+        "temp_store": settings.sqlite_temp_store,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def engine_options(url: str) -> dict:
+    """
+    create_engine arguments for `url` from the settings. Pool sizing only
+    applies to queue pools (in-memory SQLite uses a single connection) and
+    `check_same_thread` is only understood by the sync SQLite driver.
+    """
+    url = make_url(url)
+    dialect = url.get_dialect()
+    options = {
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+        "query_cache_size": settings.db_query_cache_size,
+    }
+    if issubclass(dialect.get_pool_class(url), QueuePool):
+        options.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    if url.get_backend_name() == "sqlite" and not dialect.is_async:
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+def _configure(engine: Engine, url: str):
+    if make_url(url).get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+
+
+def create_db_engine(url: str, **kwargs) -> Engine:
+    """
+    Builds an engine with the pool, statement cache and SQLite PRAGMAs of
+    the settings. `kwargs` override the computed options.
+    """
+    db_engine = create_engine(url, **{**engine_options(url), **kwargs})
+    _configure(db_engine, url)
+    return db_engine
 
 
-engine = create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False}
+def create_async_db_engine(url: str, **kwargs) -> AsyncEngine:
+    db_engine = create_async_engine(url, **{**engine_options(url), **kwargs})
+    _configure(db_engine.sync_engine, url)
+    return db_engine
+
+
+engine = create_db_engine(settings.database_url)
+replica_engines = [create_db_engine(url) for url in settings.replica_urls]
+router = (
+    ReplicaRouter(engine, replica_engines, settings.replica_retry_after)
+    if replica_engines else None
 )
 
+# Objects keep their loaded state after commit, writes already come back
+# from the database via RETURNING and don't need a refresh SELECT
 SessionLocal = sessionmaker(
-    autocommit=False, autoflush=False, bind=engine
+    class_=RoutingSession, router=router,
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
 )
 
+# The async engine is only built in async mode, so its driver (e.g.
+# aiosqlite) is only required when it is actually used
+async_engine = None
+async_replica_engines = []
+AsyncSessionLocal = None
+if settings.async_db:
+    async_engine = create_async_db_engine(settings.async_database_url)
+    async_replica_engines = [
+        create_async_db_engine(url) for url in settings.async_replica_urls
+    ]
+    async_router = None
+    if async_replica_engines:
+        async_router = ReplicaRouter(
+            async_engine.sync_engine,
+            [e.sync_engine for e in async_replica_engines],
+            settings.replica_retry_after
+        )
+    AsyncSessionLocal = async_sessionmaker(
+        sync_session_class=RoutingSession, router=async_router,
+        autoflush=False, expire_on_commit=False, bind=async_engine
+    )
+
+_sync_engines = [
+    engine,
+    *replica_engines,
+    *(e.sync_engine for e in [async_engine, *async_replica_engines] if e)
+]
+
+if settings.metrics_enabled:
+    instrument_sessions(Session)
+    for _engine in _sync_engines:
+        instrument_engine(_engine)
+
+if profiler is not None:
+    for _engine in _sync_engines:
+        profiler.attach(_engine)
+
 
 # Base ORM class used by other classes to add definitions to
 class Base(DeclarativeBase):
     pass
 
 
-def create_database_tables():
-    try:
-        Base.metadata.create_all(bind=engine)
-    except Exception as err:
-        raise err
-
-
 def get_db():
+    # The schema is managed by picpay_case.migrations at startup, so the
+    # request path never issues DDL
     db = SessionLocal()
     try:
-        create_database_tables()
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,13 +1,163 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
+import anyio.to_thread
 from fastapi import FastAPI
-from picpay_case.api.endpoints import users
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from picpay_case.api.endpoints import debug, users
+from picpay_case.api.middleware.admission import (
+    AdmissionController, AdmissionMiddleware
+)
+from picpay_case.api.middleware.compression import CompressionMiddleware
+from picpay_case.api.middleware.idempotency import IdempotencyMiddleware
+from picpay_case.api.middleware.metrics import MetricsMiddleware
+from picpay_case.core.config import settings
+from picpay_case.core.metrics import metrics
+from picpay_case.core.profiler import profiler
+from picpay_case.core.replicas import use_primary
+from picpay_case.database import (
+    SessionLocal, async_engine, async_replica_engines, engine
+)
+from picpay_case.migrations import migrate
+from picpay_case.operations.async_user import user_cache
+from picpay_case.operations.group_commit import write_coordinator
+from picpay_case.operations.idempotency import IdempotencyStore
+from picpay_case.operations.user import UserOperations
+
+logger = logging.getLogger(__name__)
+
+
+def _compact_changes():
+    with SessionLocal() as db:
+        use_primary(db)
+        superseded, purged = UserOperations(db).compact_changes(
+            settings.change_feed_retention
+        )
+    logger.info(
+        "Change feed compacted: %d superseded, %d expired",
+        superseded, purged
+    )
+
+
+def _purge_idempotency_keys():
+    purged = idempotency_store.purge_expired()
+    logger.info("Idempotency keys purged: %d expired", purged)
+
+
+async def _run_periodically(interval: float, job, description: str):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(job)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("%s failed", description)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = \
+        settings.threadpool_size
+    # Schema changes happen once here instead of on every request
+    if settings.auto_migrate:
+        migrate()
+    background = []
+    if settings.change_feed_compact_interval > 0:
+        background.append(asyncio.create_task(_run_periodically(
+            settings.change_feed_compact_interval, _compact_changes,
+            "Change feed compaction"
+        )))
+    if idempotency_store is not None and \
+            settings.idempotency_purge_interval > 0:
+        background.append(asyncio.create_task(_run_periodically(
+            settings.idempotency_purge_interval, _purge_idempotency_keys,
+            "Idempotency keys purge"
+        )))
+    yield
+    for task in background:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    if write_coordinator is not None:
+        write_coordinator.close()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica in async_replica_engines:
+        await replica.dispose()
+    if profiler is not None:
+        profiler.dump(settings.profiler_dump_path)
+
 
 app = FastAPI(
     title="Picpay Case - User CRUD API",
     description="Simple user CRUD api with FasAPI and SQLAlchemy",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
+admission = (
+    AdmissionController(
+        read_limit=settings.admission_read_limit,
+        write_limit=settings.admission_write_limit,
+        queue_size=settings.admission_queue_size,
+        queue_timeout=settings.admission_queue_timeout,
+        retry_after=settings.admission_retry_after,
+        rate=settings.admission_client_rate,
+        burst=settings.admission_client_burst,
+        client_header=settings.admission_client_header or None
+    )
+    if settings.admission_enabled else None
+)
+
+# Shared by the workers through the database, a retry may reach any of them
+idempotency_store = (
+    IdempotencyStore(
+        ttl=settings.idempotency_ttl,
+        max_keys=settings.idempotency_max_keys,
+        max_body_size=settings.idempotency_max_body_size
+    )
+    if settings.idempotency_enabled else None
+)
+
+# Middleware added last runs first: metrics measure the compression too,
+# replayed responses are compressed like fresh ones, and the idempotency
+# store queries run within the admission limits like any other query
+if idempotency_store is not None:
+    app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+
+if admission is not None:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
+if settings.compression_enabled:
+    app.add_middleware(
+        CompressionMiddleware, minimum_size=settings.compression_min_size
+    )
+
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+    metrics.register_gauge(
+        "db_pool_connections_in_use",
+        "Connections checked out from the pool",
+        lambda: {(): getattr(engine.pool, "checkedout", lambda: 0)()}
+    )
+    if admission is not None:
+        metrics.register_gauge(
+            "admission_requests",
+            "Requests admitted, queued and rejected by route class",
+            admission.stats,
+            label_names=("route_class", "state")
+        )
+    if user_cache is not None:
+        metrics.register_gauge(
+            "user_cache_stats",
+            "Lookups of the user cache by result, and its size",
+            lambda: {(k,): v for k, v in user_cache.stats().items()},
+            label_names=("event",)
+        )
+
+
 @app.get("/")
 def root():
     return {
@@ -27,9 +177,26 @@ def ping_pong():
     return {"message": "pong"}
 
 
+@app.get("/cache/stats")
+def cache_stats():
+    if user_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **user_cache.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 # Add user router
 app.include_router(users.router)
 
+if profiler is not None:
+    app.include_router(debug.router)
+
 
 def start():
     import uvicorn
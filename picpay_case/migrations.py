@@ -0,0 +1,243 @@
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import (
+    Column, DateTime, Integer, MetaData, String, Table, bindparam, func,
+    insert, inspect, select, update
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from picpay_case.database import Base, engine
+from picpay_case.models.idempotency_key import IdempotencyKey
+from picpay_case.models.user import User, fold_name
+from picpay_case.models.user_change import UserChange, UserChangeCompaction
+
+# Kept apart from Base.metadata so the migration bookkeeping is never
+# created or dropped together with the application tables
+metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+# Duplicates listed when the unique email index can't be created
+MAX_REPORTED_DUPLICATES = 20
+
+
+class MigrationError(Exception):
+    """
+    Raised when a migration can't be applied to the data in the database
+    """
+
+
+def _create_model_index(conn: Connection, table: Table, name: str):
+    # IF NOT EXISTS instead of checkfirst: expression indexes are not
+    # reflected, so checkfirst would not see them
+    index = next(i for i in table.indexes if i.name == name)
+    conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _initial_schema(conn: Connection):
+    Base.metadata.create_all(bind=conn)
+
+
+def _unique_user_email(conn: Connection):
+    users = User.__table__
+    duplicates = conn.execute(
+        select(users.c.email, func.count())
+        .group_by(users.c.email)
+        .having(func.count() > 1)
+        .order_by(users.c.email)
+    ).all()
+    if duplicates:
+        listed = ", ".join(
+            f"{email} ({count} users)"
+            for email, count in duplicates[:MAX_REPORTED_DUPLICATES]
+        )
+        if len(duplicates) > MAX_REPORTED_DUPLICATES:
+            listed += f" and {len(duplicates) - MAX_REPORTED_DUPLICATES} more"
+        raise MigrationError(
+            "Can't add the unique index on users.email, these emails belong "
+            f"to more than one user: {listed}. Merge or delete the duplicated "
+            "users and migrate again."
+        )
+    _create_model_index(conn, users, "ix_users_email")
+
+
+def _user_search_indexes(conn: Connection):
+    for name in (
+        "ix_users_phone",
+        "ix_users_birthdate",
+        "ix_users_created_at",
+        "ix_users_updated_at",
+        "ix_users_email_domain",
+    ):
+        _create_model_index(conn, User.__table__, name)
+
+
+_USERS_FTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        first_name, last_name, content='users', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO users_fts (rowid, first_name, last_name)
+        VALUES (new.id, new.first_name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_update
+    AFTER UPDATE OF first_name, last_name ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+        INSERT INTO users_fts (rowid, first_name, last_name)
+        VALUES (new.id, new.first_name, new.last_name);
+    END
+    """,
+    # Indexes the rows that existed before the triggers
+    "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+]
+
+
+def _users_full_text_search(conn: Connection):
+    # Full-text search is optional: other databases and SQLite builds
+    # without FTS5 keep working, the `q` filter is just unavailable
+    if conn.dialect.name != "sqlite":
+        return
+    if not conn.exec_driver_sql(
+        "SELECT sqlite_compileoption_used('ENABLE_FTS5')"
+    ).scalar():
+        return
+    for statement in _USERS_FTS:
+        conn.exec_driver_sql(statement)
+
+
+def _user_change_feed(conn: Connection):
+    UserChange.__table__.create(bind=conn, checkfirst=True)
+    UserChangeCompaction.__table__.create(bind=conn, checkfirst=True)
+
+
+# Rows backfilled per statement by `_folded_user_names`
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def _folded_user_names(conn: Connection):
+    """
+    Adds the case folded name columns searched by the name filter, which
+    replace the lower(name) indexes (SQLite's lower() is ASCII only)
+    """
+    users = User.__table__
+    existing = {c["name"] for c in inspect(conn).get_columns("users")}
+    for name in ("first_name_folded", "last_name_folded"):
+        if name not in existing:
+            conn.exec_driver_sql(
+                f"ALTER TABLE users ADD COLUMN {name} VARCHAR(100) "
+                "NOT NULL DEFAULT ''"
+            )
+
+    backfill = (
+        update(users)
+        .where(users.c.id == bindparam("user_id"))
+        # Not a change of the user, keeps updated_at out of the onupdate
+        .values(
+            first_name_folded=bindparam("first"),
+            last_name_folded=bindparam("last"),
+            updated_at=users.c.updated_at
+        )
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(users.c.id, users.c.first_name, users.c.last_name)
+            .where(users.c.id > last_id)
+            .order_by(users.c.id)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(backfill, [
+            {
+                "user_id": row.id,
+                "first": fold_name(row.first_name),
+                "last": fold_name(row.last_name),
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    for name in ("ix_users_first_name_folded", "ix_users_last_name_folded"):
+        _create_model_index(conn, users, name)
+    for name in ("ix_users_first_name_lower", "ix_users_last_name_lower"):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def _idempotency_keys(conn: Connection):
+    IdempotencyKey.__table__.create(bind=conn, checkfirst=True)
+
+
+# Ordered list of (version, description, upgrade). Version 1 creates the
+# tables from the current models, so later migrations must be idempotent
+# (e.g. `CREATE INDEX IF NOT EXISTS`) to also run cleanly on new databases.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Create users table", _initial_schema),
+    (2, "Unique index on users.email", _unique_user_email),
+    (3, "Search indexes on users", _user_search_indexes),
+    (4, "Full-text search on users names", _users_full_text_search),
+    (5, "Users change feed", _user_change_feed),
+    (6, "Case folded user names", _folded_user_names),
+    (7, "Idempotency keys", _idempotency_keys),
+]
+
+
+def migrate(bind: Optional[Engine] = None) -> List[int]:
+    """
+    Applies the pending migrations in a single transaction and records them
+    in `schema_migrations`. Returns the versions that were applied.
+    """
+    bind = bind or engine
+    applied = []
+
+    with bind.begin() as conn:
+        metadata.create_all(bind=conn)
+        current = set(conn.scalars(select(schema_migrations.c.version)))
+
+        for version, description, upgrade in MIGRATIONS:
+            if version in current:
+                continue
+            upgrade(conn)
+            conn.execute(
+                insert(schema_migrations).values(
+                    version=version, description=description
+                )
+            )
+            applied.append(version)
+
+    return applied
+
+
+def main():
+    try:
+        applied = migrate()
+    except MigrationError as err:
+        raise SystemExit(str(err)) from err
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}")
+    else:
+        print("Database schema is up to date")
@@ -0,0 +1,29 @@
+from datetime import datetime
+from sqlalchemy import DateTime, Integer, LargeBinary, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+from picpay_case.database import Base
+
+
+class IdempotencyKey(Base):
+    """
+    Response of the first write request sent with an Idempotency-Key,
+    replayed to its retries by every worker until `expires_at`
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    method: Mapped[str] = mapped_column(String(10), primary_key=True)
+    path: Mapped[str] = mapped_column(String(2048), primary_key=True)
+    # SHA-256 of the request body, a key can't be reused with another one
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    status: Mapped[int] = mapped_column(Integer, nullable=False)
+    # JSON list of [name, value] pairs
+    headers: Mapped[str] = mapped_column(Text, nullable=False)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, index=True
+    )
+
+    def __repr__(self) -> str:
+        return f"<IdempotencyKey({self.method} {self.path} {self.key!r})>"
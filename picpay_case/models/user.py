@@ -1,9 +1,29 @@
+import unicodedata
+from typing import Optional
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Date, DateTime
+from sqlalchemy import (
+    String, Date, DateTime, Index, column, func, literal_column, table
+)
 from picpay_case.database import Base
 from datetime import datetime, date
 
 
+def fold_name(name: Optional[str]) -> Optional[str]:
+    """
+    Case folded form of a name for the prefix searches. Folded in Python
+    because SQL lower() only lowercases ASCII in SQLite ("Ângela").
+    """
+    if name is None:
+        return None
+    return unicodedata.normalize("NFKC", name).casefold()
+
+
+def _folded(column_name: str):
+    def _default(context):
+        return fold_name(context.get_current_parameters().get(column_name))
+    return _default
+
+
 class User(Base):
     """
     User model
@@ -12,19 +32,28 @@ class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    email: Mapped[str] = mapped_column(String(320), nullable=False)
+    email: Mapped[str] = mapped_column(
+        String(320), nullable=False, unique=True, index=True
+    )
 
     first_name: Mapped[str] = mapped_column(String(50), nullable=False)
     last_name: Mapped[str] = mapped_column(String(50), nullable=False)
-    phone: Mapped[str] = mapped_column(String(20), nullable=True)
-    birthdate: Mapped[date] = mapped_column(Date, nullable=True)
+    # Filled on insert, kept in step by UserOperations on updates
+    first_name_folded: Mapped[str] = mapped_column(
+        String(100), nullable=False, index=True, default=_folded("first_name")
+    )
+    last_name_folded: Mapped[str] = mapped_column(
+        String(100), nullable=False, index=True, default=_folded("last_name")
+    )
+    phone: Mapped[str] = mapped_column(String(20), nullable=True, index=True)
+    birthdate: Mapped[date] = mapped_column(Date, nullable=True, index=True)
 
     created_at: Mapped[datetime] = mapped_column(
-        DateTime, nullable=False, default=datetime.utcnow
+        DateTime, nullable=False, default=datetime.utcnow, index=True
     )
     updated_at: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, onupdate=datetime.utcnow,
-        default=datetime.utcnow
+        default=datetime.utcnow, index=True
     )
 
     def __repr__(self) -> str:
@@ -45,3 +74,23 @@ class User(Base):
             "created_at": self.created_at,
             "updated_at": self.updated_at
         }
+
+
+# Lowercased domain part of the email. The literals are inlined instead of
+# bound so the expression of a query matches the indexed one (SQLite only
+# uses an expression index for an identical expression).
+email_domain = func.lower(
+    func.substr(
+        User.email,
+        func.instr(User.email, literal_column("'@'")) + literal_column("1")
+    )
+)
+
+Index("ix_users_email_domain", email_domain)
+
+# External content FTS5 index over the names. It is not part of the models
+# metadata: the migrations create it (SQLite only) with the triggers that
+# keep it in sync with the users table.
+users_fts = table(
+    "users_fts", column("rowid"), column("first_name"), column("last_name")
+)
@@ -0,0 +1,47 @@
+from datetime import datetime
+from sqlalchemy import DateTime, Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+from picpay_case.database import Base
+
+
+class UserChange(Base):
+    """
+    Entry of the users change feed. The ID orders the feed and is the
+    cursor of its consumers: with a single writer (SQLite) IDs become
+    visible in commit order, and AUTOINCREMENT keeps them from being reused
+    after the compaction deletes the newest entries.
+    """
+
+    __tablename__ = "user_changes"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # create, update or delete
+    operation: Mapped[str] = mapped_column(String(6), nullable=False)
+    changed_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+
+    __table_args__ = (
+        # Latest change per user, used by the compaction
+        Index("ix_user_changes_user_id_id", "user_id", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    def __repr__(self) -> str:
+        return f"<UserChange(id={self.id}, {self.operation} #{self.user_id})>"
+
+
+class UserChangeCompaction(Base):
+    """
+    Compaction run of the change feed. Changes up to `purged_through` were
+    dropped by the retention, so older cursors can't be served anymore.
+    """
+
+    __tablename__ = "user_change_compactions"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    purged_through: Mapped[int] = mapped_column(Integer, nullable=False)
+    compacted_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow
+    )
@@ -0,0 +1,251 @@
+from datetime import datetime
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from picpay_case.core.cache import LRUCache, ReadThroughCache
+from picpay_case.core.config import settings
+from picpay_case.core.notifier import user_changes
+from picpay_case.core.replicas import use_primary
+from picpay_case.models.user import User
+from picpay_case.models.user_change import UserChange
+from picpay_case.operations.group_commit import write_coordinator
+from picpay_case.operations.user import UserOperations
+from picpay_case.schemas.user import (
+    UserCreate, UserFilter, UserResponse, UserUpdate
+)
+
+# Users by ID, shared by the requests of this process. Swap the backend
+# (`user_cache.backend = ...`) to share it between processes.
+user_cache: Optional[ReadThroughCache] = (
+    ReadThroughCache(LRUCache(settings.cache_max_size, settings.cache_ttl))
+    if settings.cache_enabled else None
+)
+
+# Bulk writes are large transactions of their own, only single-user writes
+# are batched by the group commit
+_GROUP_COMMIT_WRITES = {"create_user", "update_user", "delete_user"}
+
+
+def _snapshot(user: Optional[User]) -> Optional[UserResponse]:
+    return UserResponse.model_validate(user) if user is not None else None
+
+
+class AwaitableUserOperations:
+    """
+    Awaitable interface of UserOperations used by the async endpoints.
+    Subclasses decide where the sync implementation runs through `_run`.
+
+    Single users are returned as UserResponse snapshots and read through
+    `user_cache`, which the writes below keep up to date. Single-user
+    writes go through `write_coordinator` when group commit is enabled.
+    Every write wakes the change feed readers (`user_changes`).
+    """
+
+    async def _run(self, name: str, *args, **kwargs):
+        raise NotImplementedError
+
+    def _use_primary(self):
+        raise NotImplementedError
+
+    async def _run_on_primary(self, name: str, *args, **kwargs):
+        # Every statement of a write goes to the primary, including the
+        # reads before its first write
+        self._use_primary()
+        return await self._run(name, *args, **kwargs)
+
+    async def _run_write(self, name: str, *args, **kwargs):
+        try:
+            if write_coordinator is not None and name in _GROUP_COMMIT_WRITES:
+                return await write_coordinator.submit(name, *args, **kwargs)
+            return await self._run_on_primary(name, *args, **kwargs)
+        finally:
+            user_changes.notify()
+
+    async def close(self):
+        raise NotImplementedError
+
+    def iter_users(self, chunk_size: int = 1000) -> AsyncIterator[List[User]]:
+        raise NotImplementedError
+
+    async def create_user(
+        self,
+        user_data: UserCreate
+    ) -> Optional[UserResponse]:
+        user = _snapshot(await self._run_write("create_user", user_data))
+        if user is not None and user_cache is not None:
+            user_cache.set(user.id, user)
+        return user
+
+    async def create_users(
+        self,
+        users_data: List[UserCreate]
+    ) -> List[Optional[int]]:
+        return await self._run_write("create_users", users_data)
+
+    async def get_user(
+        self,
+        user_id: int,
+        fields: Optional[Sequence[str]] = None
+    ) -> Optional[UserResponse]:
+        # Projections are narrow column reads, they bypass the cache
+        if fields is not None:
+            return await self._run("get_user", user_id, fields)
+
+        async def _load():
+            return _snapshot(await self._run("get_user", user_id))
+
+        if user_cache is None:
+            return await _load()
+        return await user_cache.get_or_load(user_id, _load)
+
+    async def user_exists(self, key, value) -> bool:
+        return await self._run("user_exists", key, value)
+
+    async def get_users(
+        self,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+        filters: Optional[UserFilter] = None,
+        sort: str = "id",
+        after_value: Any = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[User]:
+        return await self._run(
+            "get_users", limit=limit, after_id=after_id, filters=filters,
+            sort=sort, after_value=after_value, fields=fields
+        )
+
+    async def get_users_page_stats(
+        self,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+        filters: Optional[UserFilter] = None,
+        sort: str = "id",
+        after_value: Any = None
+    ) -> Tuple[int, Optional[datetime], Optional[int]]:
+        return await self._run(
+            "get_users_page_stats", limit=limit, after_id=after_id,
+            filters=filters, sort=sort, after_value=after_value
+        )
+
+    async def update_user(
+        self,
+        user_id: int,
+        user_data: UserUpdate
+    ) -> Optional[UserResponse]:
+        user = _snapshot(
+            await self._run_write("update_user", user_id, user_data)
+        )
+        if user is not None and user_cache is not None:
+            user_cache.set(user.id, user)
+        return user
+
+    async def update_users(
+        self,
+        user_data: UserUpdate,
+        user_ids: Optional[List[int]] = None,
+        filters: Optional[UserFilter] = None
+    ) -> List[int]:
+        updated = await self._run_write(
+            "update_users", user_data, user_ids=user_ids, filters=filters
+        )
+        if user_cache is not None:
+            for user_id in updated:
+                user_cache.invalidate(user_id)
+        return updated
+
+    async def delete_users(
+        self,
+        user_ids: Optional[List[int]] = None,
+        filters: Optional[UserFilter] = None
+    ) -> List[int]:
+        deleted = await self._run_write(
+            "delete_users", user_ids=user_ids, filters=filters
+        )
+        if user_cache is not None:
+            for user_id in deleted:
+                user_cache.invalidate(user_id)
+        return deleted
+
+    async def delete_user(self, user_id: int) -> bool:
+        deleted = await self._run_write("delete_user", user_id)
+        if user_cache is not None:
+            user_cache.invalidate(user_id)
+        return deleted
+
+    async def get_changes(
+        self,
+        since: int = 0,
+        limit: int = 100
+    ) -> List[Tuple[UserChange, Optional[User]]]:
+        return await self._run("get_changes", since, limit)
+
+    async def get_change_cursors(self) -> Tuple[int, int]:
+        return await self._run("get_change_cursors")
+
+    async def compact_changes(self, retention: float) -> Tuple[int, int]:
+        return await self._run_on_primary("compact_changes", retention)
+
+
+class ThreadPoolUserOperations(AwaitableUserOperations):
+    """
+    Runs a sync UserOperations in the threadpool, the sync mode of the API
+    """
+
+    def __init__(self, user_op: UserOperations):
+        self.user_op = user_op
+
+    async def _run(self, name: str, *args, **kwargs):
+        method = getattr(self.user_op, name)
+        return await run_in_threadpool(method, *args, **kwargs)
+
+    def _use_primary(self):
+        use_primary(self.user_op.db)
+
+    async def close(self):
+        await run_in_threadpool(self.user_op.db.close)
+
+    async def iter_users(
+        self,
+        chunk_size: int = 1000
+    ) -> AsyncIterator[List[User]]:
+        chunks = self.user_op.iter_users(chunk_size)
+        async for chunk in iterate_in_threadpool(chunks):
+            yield chunk
+
+
+class AsyncUserOperations(AwaitableUserOperations):
+    """
+    Runs UserOperations on an AsyncSession. Calls go through `run_sync`, so
+    the same ORM code is executed by the async driver on the event loop,
+    without holding a thread per request.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def _run(self, name: str, *args, **kwargs):
+        def _call(session):
+            return getattr(UserOperations(session), name)(*args, **kwargs)
+
+        return await self.db.run_sync(_call)
+
+    def _use_primary(self):
+        use_primary(self.db)
+
+    async def close(self):
+        await self.db.close()
+
+    async def iter_users(
+        self,
+        chunk_size: int = 1000
+    ) -> AsyncIterator[List[User]]:
+        stmt = (
+            select(User)
+            .order_by(User.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        result = await self.db.stream_scalars(stmt)
+        async for chunk in result.partitions():
+            yield chunk
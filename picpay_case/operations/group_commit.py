@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from picpay_case.core.config import settings
+from picpay_case.core.replicas import use_primary
+from picpay_case.database import SessionLocal
+from picpay_case.operations.user import UserOperations
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class _Write:
+    __slots__ = ("name", "args", "kwargs", "future")
+
+    def __init__(self, name: str, args: tuple, kwargs: dict):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+
+def _begin(session: Session):
+    conn = session.connection()
+    if conn.dialect.name == "sqlite":
+        # pysqlite only opens a transaction before DML, so the first
+        # SAVEPOINT would open it instead and its RELEASE would commit.
+        # IMMEDIATE also takes the write lock once for the whole batch.
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+class WriteCoordinator:
+    """
+    Group commit for single-user writes. Writes submitted by concurrent
+    requests are queued for one writer thread, which applies every write
+    arriving within `window` seconds of the first (up to `max_batch`) in a
+    single transaction with one COMMIT.
+
+    Each write runs in its own savepoint (UserOperations in managed mode),
+    so a failing write is rolled back alone, and its caller gets its own
+    result or exception once the batch is committed.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        window: float = 0.002,
+        max_batch: int = 100
+    ):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="write-coordinator", daemon=True
+                )
+                self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """
+        Stops the writer once the writes queued so far are applied
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    async def submit(self, name: str, *args, **kwargs):
+        """
+        Runs the UserOperations method `name` in the next batch and returns
+        its result (or raises its exception) after the batch commits
+        """
+        write = _Write(name, args, kwargs)
+        self.start()
+        self._queue.put(write)
+        return await asyncio.wrap_future(write.future)
+
+    def _collect(self, first: _Write) -> tuple:
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                write = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if write is _STOP:
+                return batch, True
+            batch.append(write)
+        return batch, False
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            if write is _STOP:
+                return
+            batch, stop = self._collect(write)
+            self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch: List[_Write]):
+        # Writes whose caller went away (cancelled requests) are skipped
+        batch = [w for w in batch if w.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        outcomes = []
+        with self.session_factory() as session:
+            use_primary(session)
+            try:
+                _begin(session)
+                user_op = UserOperations(session, managed=True)
+                for write in batch:
+                    try:
+                        method = getattr(user_op, write.name)
+                        result = method(*write.args, **write.kwargs)
+                        outcomes.append((write, result, None))
+                    except Exception as err:  # pylint: disable=broad-except
+                        outcomes.append((write, None, err))
+                session.commit()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.exception(
+                    "Group commit of %d writes failed", len(batch)
+                )
+                session.rollback()
+                for write in batch:
+                    write.future.set_exception(err)
+                return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for write, result, err in outcomes:
+            if err is not None:
+                write.future.set_exception(err)
+            else:
+                write.future.set_result(result)
+
+
+write_coordinator: Optional[WriteCoordinator] = (
+    WriteCoordinator(
+        window=settings.group_commit_window_ms / 1000,
+        max_batch=settings.group_commit_max_batch
+    )
+    if settings.group_commit_enabled else None
+)
@@ -0,0 +1,154 @@
+import json
+from datetime import datetime, timedelta
+from typing import Hashable, Optional
+
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from picpay_case.api.middleware.idempotency import StoredResponse
+from picpay_case.core.cache import CacheBackend
+from picpay_case.core.replicas import use_primary
+from picpay_case.database import SessionLocal
+from picpay_case.models.idempotency_key import IdempotencyKey
+
+
+def _where_key(key: Hashable) -> list:
+    method, path, idempotency_key = key
+    return [
+        IdempotencyKey.key == idempotency_key,
+        IdempotencyKey.method == method,
+        IdempotencyKey.path == path,
+    ]
+
+
+class IdempotencyStore(CacheBackend):
+    """
+    Stored responses of the idempotency middleware in the
+    `idempotency_keys` table, shared by every worker. Keys are
+    (method, path, Idempotency-Key) tuples and expire `ttl` seconds after
+    the first response was stored; expired rows are ignored until
+    `purge_expired` deletes them.
+
+    The table holds at most `max_keys` rows, the oldest are deleted to make
+    room, and bodies over `max_body_size` bytes aren't stored (retries of
+    those requests run again).
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker = SessionLocal,
+        ttl: float = 24 * 3600,
+        max_keys: int = 10000,
+        max_body_size: int = 64 * 1024
+    ):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.max_body_size = max_body_size
+
+    def _session(self) -> Session:
+        db = self.session_factory()
+        # A retry may reach a worker right after the first response was
+        # stored, before a replica has it
+        use_primary(db)
+        return db
+
+    def get(self, key: Hashable) -> Optional[StoredResponse]:
+        with self._session() as db:
+            row = db.scalar(
+                select(IdempotencyKey).where(
+                    *_where_key(key),
+                    IdempotencyKey.expires_at > datetime.utcnow()
+                )
+            )
+        if row is None:
+            return None
+        return StoredResponse(
+            row.fingerprint,
+            row.status,
+            [
+                (name.encode("latin-1"), value.encode("latin-1"))
+                for name, value in json.loads(row.headers)
+            ],
+            row.body
+        )
+
+    def set(self, key: Hashable, value: StoredResponse):
+        if len(value.body) > self.max_body_size:
+            return
+        method, path, idempotency_key = key
+        now = datetime.utcnow()
+        with self._session() as db:
+            try:
+                # An expired response of the key makes room for the new one
+                db.execute(delete(IdempotencyKey).where(
+                    *_where_key(key), IdempotencyKey.expires_at <= now
+                ))
+                db.add(IdempotencyKey(
+                    key=idempotency_key,
+                    method=method,
+                    path=path,
+                    fingerprint=value.fingerprint,
+                    status=value.status,
+                    headers=json.dumps([
+                        [name.decode("latin-1"), val.decode("latin-1")]
+                        for name, val in value.headers
+                    ]),
+                    body=value.body,
+                    expires_at=now + timedelta(seconds=self.ttl)
+                ))
+                db.flush()
+                self._evict(db)
+                db.commit()
+            except IntegrityError:
+                # Another worker stored its response first, which is the
+                # one replayed from now on
+                db.rollback()
+
+    def _evict(self, db: Session):
+        # Oldest first, which takes the expired rows before the others
+        excess = db.scalar(
+            select(func.count()).select_from(IdempotencyKey)
+        ) - self.max_keys
+        if excess <= 0:
+            return
+        columns = (
+            IdempotencyKey.key, IdempotencyKey.method, IdempotencyKey.path
+        )
+        db.execute(delete(IdempotencyKey).where(tuple_(*columns).in_(
+            select(*columns)
+            .order_by(IdempotencyKey.expires_at)
+            .limit(excess)
+        )))
+
+    def delete(self, key: Hashable):
+        with self._session() as db:
+            db.execute(delete(IdempotencyKey).where(*_where_key(key)))
+            db.commit()
+
+    def clear(self):
+        with self._session() as db:
+            db.execute(delete(IdempotencyKey))
+            db.commit()
+
+    def __len__(self) -> int:
+        with self._session() as db:
+            return db.scalar(
+                select(func.count()).select_from(IdempotencyKey).where(
+                    IdempotencyKey.expires_at > datetime.utcnow()
+                )
+            )
+
+    def purge_expired(self) -> int:
+        """
+        Deletes the expired responses. Returns how many were deleted.
+        """
+        with self._session() as db:
+            deleted = db.execute(
+                delete(IdempotencyKey).where(
+                    IdempotencyKey.expires_at <= datetime.utcnow()
+                )
+            ).rowcount
+            db.commit()
+        return deleted
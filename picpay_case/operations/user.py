@@ -1,72 +1,594 @@
-from typing import List, Optional
-from sqlalchemy import exists
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+from sqlalchemy import (
+    Select, and_, delete, exists, func, insert, literal_column, or_, select,
+    tuple_, update
+)
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session
-from picpay_case.models.user import User
-from picpay_case.schemas.user import UserCreate, UserUpdate
+from picpay_case.models.user import User, email_domain, fold_name, users_fts
+from picpay_case.models.user_change import UserChange, UserChangeCompaction
+from picpay_case.schemas.user import UserCreate, UserFilter, UserUpdate
+
+# Keeps `IN (...)` lists below the bound parameter limit of the database
+IN_CHUNK_SIZE = 5000
+
+# Columns behind each UserSort field
+SORT_COLUMNS = {
+    "id": User.id,
+    "created_at": User.created_at,
+    "updated_at": User.updated_at,
+    "email": User.email,
+}
+
+
+class UserConflictError(Exception):
+    """
+    Raised when a write collides with the unique email of another user
+    """
+
+
+def _is_email_conflict(err: IntegrityError) -> bool:
+    """
+    Whether the integrity error is a violation of the unique email index,
+    as reported by SQLite (the column) or PostgreSQL (the index name)
+    """
+    message = str(err.orig)
+    return "users.email" in message or '"ix_users_email"' in message
+
+
+class UserSearchUnavailableError(Exception):
+    """
+    Raised on full-text searches when the database has no FTS index
+    """
+
+
+def _columns(fields: Optional[Sequence[str]]) -> Select:
+    """
+    Selects the whole User entity, or only the given columns: rows are then
+    returned as plain Row tuples, skipping ORM hydration and identity map
+    """
+    if fields is None:
+        return select(User)
+    return select(*(getattr(User, name) for name in fields))
+
+
+def _prefix_range(column, prefix: str):
+    """
+    `column LIKE 'prefix%'` over a folded name column written as a range,
+    which the database answers from the column index
+    """
+    prefix = fold_name(prefix)
+    upper = _prefix_upper_bound(prefix)
+    if upper is None:
+        return column >= prefix
+    return and_(column >= prefix, column < upper)
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Smallest string after every string starting with `prefix`, None when
+    the prefix is only made of the last code point
+    """
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:
+            # Surrogates can't be encoded, the next character is U+E000
+            code = 0xE000
+        if code <= sys.maxunicode:
+            return prefix[:-1] + chr(code)
+        prefix = prefix[:-1]
+    return None
+
+
+def _with_folded_names(values: dict) -> dict:
+    # Updates of the names also update their folded search columns
+    for name in ("first_name", "last_name"):
+        if values.get(name) is not None:
+            values[f"{name}_folded"] = fold_name(values[name])
+    return values
+
+
+def _fts_query(text: str) -> str:
+    # Every word is quoted (so FTS5 operators in the input are not parsed)
+    # and matched as a prefix: "ana sil" finds "Ana Silva"
+    return " ".join(
+        '"' + word.replace('"', '""') + '"*' for word in text.split()
+    )
+
+
+def _filter_clauses(filters: UserFilter) -> list:
+    clauses = []
+    if filters.name is not None:
+        clauses.append(or_(
+            _prefix_range(User.first_name_folded, filters.name),
+            _prefix_range(User.last_name_folded, filters.name)
+        ))
+    if filters.email is not None:
+        clauses.append(User.email == filters.email)
+    if filters.email_domain is not None:
+        clauses.append(email_domain == filters.email_domain.lower())
+    if filters.phone is not None:
+        clauses.append(User.phone == filters.phone)
+
+    for column, low, high in (
+        (User.birthdate, filters.birthdate_from, filters.birthdate_to),
+        (User.created_at, filters.created_from, filters.created_to),
+        (User.updated_at, filters.updated_from, filters.updated_to),
+    ):
+        if low is not None:
+            clauses.append(column >= low)
+        if high is not None:
+            clauses.append(column <= high)
+
+    if filters.q is not None and filters.q.split():
+        matches = select(users_fts.c.rowid).where(
+            literal_column("users_fts").op("MATCH")(_fts_query(filters.q))
+        )
+        clauses.append(User.id.in_(matches))
+    return clauses
 
 
 class UserOperations:
     """
-    Encapsulates operations for User entity
+    Encapsulates operations for User entity.
+
+    A `managed` instance runs inside a transaction owned by its caller (see
+    WriteCoordinator): each write is a savepoint instead of a commit.
     """
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, managed: bool = False):
         self.db = db
+        self.managed = managed
+
+    @contextmanager
+    def _write(self):
+        """
+        Unit of work for a single write: commits on success and rolls back
+        when anything inside the block fails
+        """
+        if self.managed:
+            with self.db.begin_nested():
+                yield
+            return
 
-    def create_user(self, user_data: UserCreate) -> User:
+        try:
+            yield
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
 
-        user_d = user_data.model_dump()
+    def _record_changes(self, operation: str, user_ids: Sequence[int]):
+        """
+        Appends the writes to the change feed, to be called inside the
+        `_write` block so they are committed with the change itself
+        """
+        if user_ids:
+            self.db.execute(
+                insert(UserChange),
+                [{"user_id": i, "operation": operation} for i in user_ids]
+            )
 
-        if self.user_exists("email", user_data.email):
+    def create_user(self, user_data: UserCreate) -> Optional[User]:
+        """
+        Inserts the user in one INSERT ... RETURNING statement. The unique
+        index on email rejects duplicates, in which case None is returned.
+        """
+        try:
+            with self._write():
+                create_user = self.db.scalar(
+                    insert(User)
+                    .values(**user_data.model_dump())
+                    .returning(User)
+                )
+                self._record_changes("create", [create_user.id])
+        except IntegrityError as err:
+            if not _is_email_conflict(err):
+                raise
             return None
 
-        create_user = User(**user_d)
+        return create_user
+
+    def create_users(
+        self,
+        users_data: List[UserCreate]
+    ) -> List[Optional[int]]:
+        """
+        Creates many users in a single transaction. Returns the ID of each
+        created user in the input order, or None for the entries whose email
+        already exists (in the database or earlier in the same batch).
+        """
+        emails = [u.email for u in users_data]
 
-        self.db.add(create_user)
-        self.db.commit()
-        self.db.refresh(create_user)
+        taken = set()
+        for i in range(0, len(emails), IN_CHUNK_SIZE):
+            chunk = emails[i:i + IN_CHUNK_SIZE]
+            taken.update(self.db.scalars(
+                select(User.email).where(User.email.in_(chunk))
+            ))
 
-        return create_user
+        rows, positions = [], []
+        for position, user_data in enumerate(users_data):
+            if user_data.email in taken:
+                continue
+            taken.add(user_data.email)
+            rows.append(user_data.model_dump())
+            positions.append(position)
+
+        ids: List[Optional[int]] = [None] * len(users_data)
+        if not rows:
+            return ids
+
+        try:
+            with self._write():
+                created_ids = self.db.scalars(
+                    insert(User).returning(
+                        User.id, sort_by_parameter_order=True
+                    ),
+                    rows
+                ).all()
+                self._record_changes("create", created_ids)
+        except IntegrityError as err:
+            if not _is_email_conflict(err):
+                raise
+            # An email was taken by a concurrent write after the check
+            raise UserConflictError(str(err.orig)) from err
+
+        for position, user_id in zip(positions, created_ids):
+            ids[position] = user_id
 
-    def get_user(self, user_id: int) -> Optional[User]:
-        return self.db.query(User).filter(User.id == user_id).first()
+        return ids
+
+    def get_user(
+        self,
+        user_id: int,
+        fields: Optional[Sequence[str]] = None
+    ) -> Optional[User]:
+        """
+        Returns the user, or a Row with only `fields` when they are given
+        """
+        if fields is None:
+            return self.db.query(User).filter(User.id == user_id).first()
+        return self.db.execute(
+            _columns(fields).where(User.id == user_id)
+        ).first()
 
     def user_exists(self, key, value) -> bool:
         return self.db.query(exists().where(getattr(User, key) == value)).scalar()
 
-    def get_users(self) -> List[User]:
-        return self.db.query(User).all()
+    @staticmethod
+    def _page(
+        stmt: Select,
+        limit: Optional[int],
+        after_id: Optional[int],
+        filters: Optional[UserFilter],
+        sort: str,
+        after_value: Any
+    ) -> Select:
+        """
+        Applies the filters, the sort and the keyset position to `stmt`.
+        Rows are ordered by (sort column, ID) and a page starts right after
+        the (value, ID) of the previous one, so it is a range scan on the
+        sort column index.
+        """
+        if filters is not None:
+            stmt = stmt.where(*_filter_clauses(filters))
+
+        descending = sort.startswith("-")
+        column = SORT_COLUMNS[sort.lstrip("-")]
+
+        if after_id is not None:
+            if column is User.id:
+                key, position = User.id, after_id
+            else:
+                # Binds take their types from the columns of the tuple
+                key = tuple_(column, User.id)
+                position = (after_value, after_id)
+            stmt = stmt.where(key < position if descending else key > position)
+
+        order = [column] if column is User.id else [column, User.id]
+        if descending:
+            order = [c.desc() for c in order]
+        stmt = stmt.order_by(*order)
+
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt
+
+    def _search(self, stmt: Select, filters: Optional[UserFilter]):
+        try:
+            return self.db.execute(stmt)
+        except OperationalError as err:
+            if filters is not None and filters.q is not None:
+                raise UserSearchUnavailableError(str(err.orig)) from err
+            raise
+
+    def get_users(
+        self,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+        filters: Optional[UserFilter] = None,
+        sort: str = "id",
+        after_value: Any = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[User]:
+        """
+        Returns the users matching `filters` ordered by `sort` (a UserSort)
+        and then ID. When `after_id` is given (with the sort column value of
+        that user as `after_value`), only the users after it are returned,
+        which is keyset pagination: each page is an index range scan
+        regardless of the table size.
+
+        With `fields` only those columns are loaded, as Row tuples.
+        """
+        stmt = self._page(
+            _columns(fields), limit, after_id, filters, sort, after_value
+        )
+        result = self._search(stmt, filters)
+        return result.all() if fields is not None else result.scalars().all()
+
+    def get_users_page_stats(
+        self,
+        limit: Optional[int] = None,
+        after_id: Optional[int] = None,
+        filters: Optional[UserFilter] = None,
+        sort: str = "id",
+        after_value: Any = None
+    ) -> Tuple[int, Optional[datetime], Optional[int]]:
+        """
+        Returns (count, max updated_at, sum of the IDs) of the page
+        `get_users` would return, an aggregate over the page that doesn't
+        load the rows. The sum of the IDs tells which rows are on the page:
+        a row leaving it (deleted, or pushed out by a sort value) changes it
+        even when the row taking its place is older.
+        """
+        page = self._page(
+            select(User.id, User.updated_at),
+            limit, after_id, filters, sort, after_value
+        ).subquery()
+
+        count, last_update, id_sum = self._search(
+            select(
+                func.count(),
+                func.max(page.c.updated_at),
+                func.sum(page.c.id)
+            ),
+            filters
+        ).one()
+        return count, last_update, id_sum
+
+    def iter_users(self, chunk_size: int = 1000) -> Iterator[List[User]]:
+        """
+        Yields every user ordered by ID in chunks of `chunk_size` rows. Rows
+        are fetched from the cursor as the chunks are consumed, so memory
+        stays bounded by the chunk size instead of the table size.
+        """
+        stmt = (
+            select(User)
+            .order_by(User.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for chunk in self.db.scalars(stmt).partitions():
+            yield chunk
 
     def update_user(
             self,
             user_id: int,
             user_data: UserUpdate
     ) -> Optional[User]:
-        db_user = self.get_user(user_id)
-        if not db_user:
-            return None
-
+        """
+        Updates the user in one UPDATE ... RETURNING statement, `updated_at`
+        is set by the column's onupdate in the same statement. Returns None
+        when no row matched the ID.
+        """
         # Dump model as a dictionary excluding null columns
-        update_data = user_data.model_dump(exclude_unset=True)
+        update_data = _with_folded_names(
+            user_data.model_dump(exclude_unset=True)
+        )
+        if not update_data:
+            return self.get_user(user_id)
 
-        for field, value in update_data.items():
-            setattr(db_user, field, value)
-
-        # Commit changes and reload user info
-        self.db.commit()
-        self.db.refresh(db_user)
+        try:
+            with self._write():
+                db_user = self.db.scalar(
+                    update(User)
+                    .where(User.id == user_id)
+                    .values(**update_data)
+                    .returning(User)
+                )
+                if db_user is not None:
+                    self._record_changes("update", [db_user.id])
+        except IntegrityError as err:
+            if not _is_email_conflict(err):
+                raise
+            raise UserConflictError(str(err.orig)) from err
 
         return db_user
 
+    def _bulk_write(
+        self,
+        operation: str,
+        write,
+        user_ids: Optional[Sequence[int]],
+        filters: Optional[UserFilter],
+        chunk_size: int
+    ) -> List[int]:
+        """
+        Runs the set-based `write(id_clause)` statement (which must return
+        the IDs of its rows) over the selected users in chunks of at most
+        `chunk_size` rows, all in one transaction
+        """
+        with self._write():
+            if user_ids is not None:
+                affected = []
+                for i in range(0, len(user_ids), chunk_size):
+                    chunk = user_ids[i:i + chunk_size]
+                    affected.extend(self.db.scalars(
+                        write(User.id.in_(chunk))
+                    ))
+            else:
+                affected = self._bulk_write_filtered(
+                    write, filters, chunk_size
+                )
+            self._record_changes(operation, affected)
+        return affected
+
+    def _bulk_write_filtered(
+        self,
+        write,
+        filters: UserFilter,
+        chunk_size: int
+    ) -> List[int]:
+        # Walks the matching users by ID, so rows the write moves out of
+        # (or into) the filter are never visited twice
+        clauses = _filter_clauses(filters)
+        affected: List[int] = []
+        last_id = None
+        while True:
+            chunk = select(User.id).where(*clauses)
+            if last_id is not None:
+                chunk = chunk.where(User.id > last_id)
+            chunk = chunk.order_by(User.id).limit(chunk_size)
+
+            ids = self._search(
+                write(User.id.in_(chunk.scalar_subquery())), filters
+            ).scalars().all()
+            affected.extend(ids)
+            if len(ids) < chunk_size:
+                return affected
+            last_id = max(ids)
+
+    def update_users(
+        self,
+        user_data: UserUpdate,
+        user_ids: Optional[Sequence[int]] = None,
+        filters: Optional[UserFilter] = None,
+        chunk_size: int = IN_CHUNK_SIZE
+    ) -> List[int]:
+        """
+        Applies the same changes to the users with the given IDs or matching
+        `filters`, as chunked UPDATE ... RETURNING statements in a single
+        transaction. Returns the IDs of the updated users.
+        """
+        update_data = _with_folded_names(
+            user_data.model_dump(exclude_unset=True)
+        )
+        try:
+            return self._bulk_write(
+                "update",
+                lambda where: update(User)
+                .where(where)
+                .values(**update_data)
+                .returning(User.id),
+                user_ids, filters, chunk_size
+            )
+        except IntegrityError as err:
+            if not _is_email_conflict(err):
+                raise
+            raise UserConflictError(str(err.orig)) from err
+
+    def delete_users(
+        self,
+        user_ids: Optional[Sequence[int]] = None,
+        filters: Optional[UserFilter] = None,
+        chunk_size: int = IN_CHUNK_SIZE
+    ) -> List[int]:
+        """
+        Deletes the users with the given IDs or matching `filters`, as
+        chunked DELETE ... RETURNING statements in a single transaction.
+        Returns the IDs of the deleted users.
+        """
+        return self._bulk_write(
+            "delete",
+            lambda where: delete(User).where(where).returning(User.id),
+            user_ids, filters, chunk_size
+        )
+
     def delete_user(
         self,
         user_id: str
     ) -> bool:
-        db_user = self.get_user(user_id)
-        if not db_user:
-            return False
+        """
+        Deletes the user in one DELETE ... RETURNING statement, returns
+        whether a row was actually deleted
+        """
+        with self._write():
+            deleted_id = self.db.scalar(
+                delete(User).where(User.id == user_id).returning(User.id)
+            )
+            if deleted_id is not None:
+                self._record_changes("delete", [deleted_id])
+
+        return deleted_id is not None
+
+    def get_changes(
+        self,
+        since: int = 0,
+        limit: int = 100
+    ) -> List[Tuple[UserChange, Optional[User]]]:
+        """
+        Returns the changes after the `since` change ID in order, each with
+        the current state of its user (None once the user is deleted)
+        """
+        rows = self.db.execute(
+            select(UserChange, User)
+            .outerjoin(User, User.id == UserChange.user_id)
+            .where(UserChange.id > since)
+            .order_by(UserChange.id)
+            .limit(limit)
+        ).all()
+        return [(change, user) for change, user in rows]
+
+    def get_change_cursors(self) -> Tuple[int, int]:
+        """
+        Returns (horizon, latest) change IDs: cursors below the horizon
+        point to changes dropped by the retention
+        """
+        horizon = self.db.scalar(
+            select(func.max(UserChangeCompaction.purged_through))
+        ) or 0
+        latest = self.db.scalar(select(func.max(UserChange.id))) or 0
+        return horizon, max(horizon, latest)
+
+    def compact_changes(self, retention: float) -> Tuple[int, int]:
+        """
+        Compacts the change feed: drops the changes superseded by a newer
+        change of the same user (readers get the current user state anyway)
+        and every change older than `retention` seconds. Returns how many
+        changes each step removed.
+        """
+        with self._write():
+            latest = self.db.scalar(select(func.max(UserChange.id)))
+            if latest is None:
+                return 0, 0
+
+            newest_per_user = (
+                select(func.max(UserChange.id))
+                .group_by(UserChange.user_id)
+            )
+            superseded = self.db.execute(
+                delete(UserChange)
+                .where(UserChange.id <= latest)
+                .where(UserChange.id.not_in(newest_per_user))
+            ).rowcount
 
-        self.db.delete(db_user)
-        self.db.commit()
+            cutoff = datetime.utcnow() - timedelta(seconds=retention)
+            purged_through = self.db.scalar(
+                select(func.max(UserChange.id))
+                .where(UserChange.changed_at < cutoff)
+            )
+            purged = 0
+            if purged_through is not None:
+                purged = self.db.execute(
+                    delete(UserChange)
+                    .where(UserChange.id <= purged_through)
+                ).rowcount
+                self.db.execute(
+                    insert(UserChangeCompaction)
+                    .values(purged_through=purged_through)
+                )
 
-        return True
+        return superseded, purged
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import Generic, Optional, TypeVar
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import Any, Generic, Optional, TypeVar
+from typing_extensions import TypedDict
 
 T = TypeVar('T')
 
@@ -15,6 +16,11 @@ class APIResponse(BaseModel, Generic[T]):
         description="Message describing the response"
     )
 
+    next_cursor: Optional[str] = Field(
+        default=None,
+        description="Cursor for the next page, null on the last page"
+    )
+
 
 class Response(APIResponse[T]):
 
@@ -22,17 +28,78 @@ class Response(APIResponse[T]):
         self,
         data: Optional[T] = {},
         message: Optional[str] = None,
+        next_cursor: Optional[str] = None,
         **kwargs
     ):
         super().__init__(
             data=data,
-            message=message or "Operation successfull"
+            message=message or "Operation successfull",
+            next_cursor=next_cursor
         )
 
 
 def success_response(
     data: Optional[T] = {},
-    message: Optional[str] = None
+    message: Optional[str] = None,
+    next_cursor: Optional[str] = None
 ) -> APIResponse[T]:
     """"""
-    return Response(data=data if data else {}, message=message)
+    return Response(
+        data=data if data else {},
+        message=message,
+        next_cursor=next_cursor
+    )
+
+
+class _Envelope(TypedDict):
+    data: Any
+    message: Optional[str]
+    next_cursor: Optional[str]
+
+
+_envelope_adapter = TypeAdapter(_Envelope)
+
+
+def _envelope(
+    data: Optional[T],
+    message: Optional[str],
+    next_cursor: Optional[str],
+    empty: Any
+) -> _Envelope:
+    return {
+        "data": data if data else empty,
+        "message": message or "Operation successfull",
+        "next_cursor": next_cursor
+    }
+
+
+def success_json(
+    data: Optional[T] = {},
+    message: Optional[str] = None,
+    next_cursor: Optional[str] = None,
+    empty: Any = {}
+) -> bytes:
+    """
+    Same JSON document as `success_response`, serialized straight to bytes
+    by pydantic-core instead of building a Response model and walking it
+    again with FastAPI's jsonable_encoder. Empty data is sent as `empty`,
+    e.g. [] for endpoints whose data is a list.
+    """
+    return _envelope_adapter.dump_json(
+        _envelope(data, message, next_cursor, empty)
+    )
+
+
+def success_dict(
+    data: Optional[T] = {},
+    message: Optional[str] = None,
+    next_cursor: Optional[str] = None,
+    empty: Any = {}
+) -> dict:
+    """
+    The envelope as plain Python values (dates and datetimes kept as
+    objects) for the binary formats
+    """
+    return _envelope_adapter.dump_python(
+        _envelope(data, message, next_cursor, empty)
+    )
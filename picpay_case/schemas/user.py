@@ -1,6 +1,10 @@
-from typing import Optional
-from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
+from typing import List, Literal, Optional
+from pydantic import (
+    BaseModel, ConfigDict, EmailStr, Field, TypeAdapter, field_validator,
+    model_validator
+)
 from datetime import datetime, date
+from picpay_case.core.config import settings
 
 
 class UserBase(BaseModel):
@@ -37,9 +41,127 @@ class UserResponse(UserBase):
     updated_at: datetime
 
 
+# Validates a whole list of ORM users in a single pydantic-core call
+user_list_adapter = TypeAdapter(List[UserResponse])
+
+
 class UserUpdate(BaseModel):
     email: Optional[str] = None
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     phone: Optional[str] = None
     birthdate: Optional[date] = None
+
+    # Fields left out aren't changed, but every column is required, so an
+    # explicit null is invalid
+    @field_validator("*")
+    def validate_not_null(cls, v, info):  # pylint: disable=no-self-argument
+        if v is None:
+            raise ValueError(f"{info.field_name} cannot be null.")
+        return v
+
+
+# Sortable fields of the user listing, prefixed with "-" for descending.
+# Each one is indexed and non-null, so keyset pages stay index range scans.
+UserSort = Literal[
+    "id", "-id",
+    "created_at", "-created_at",
+    "updated_at", "-updated_at",
+    "email", "-email",
+]
+
+
+class UserFilter(BaseModel):
+    """
+    Filters of the user listing, combined with AND. Ranges are inclusive.
+    """
+    name: Optional[str] = Field(
+        default=None, min_length=1, max_length=50,
+        description="Case-insensitive prefix of the first or last name"
+    )
+    email: Optional[str] = None
+    email_domain: Optional[str] = Field(
+        default=None, min_length=1, description="e.g. example.com"
+    )
+    phone: Optional[str] = None
+    birthdate_from: Optional[date] = None
+    birthdate_to: Optional[date] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    updated_from: Optional[datetime] = None
+    updated_to: Optional[datetime] = None
+    q: Optional[str] = Field(
+        default=None, min_length=1, max_length=200,
+        description="Full-text search over the names (SQLite FTS5)"
+    )
+
+
+class UserListQuery(UserFilter):
+    """
+    Query string of the user listing: the filters plus sort and paging
+    """
+    sort: UserSort = "id"
+    limit: int = Field(
+        default=settings.page_size_default, ge=1, le=settings.page_size_max
+    )
+    cursor: Optional[str] = None
+    fields: Optional[str] = Field(
+        default=None, description="Comma separated fields to return"
+    )
+
+
+class UserBulkCreateResult(BaseModel):
+    index: int
+    email: str
+    status: Literal["created", "conflict"]
+    id: Optional[int] = None
+
+
+class UserBulkSelection(BaseModel):
+    """
+    Users targeted by a bulk write: either the given IDs or every user
+    matching a (non-empty) filter
+    """
+    ids: Optional[List[int]] = Field(
+        default=None, min_length=1, max_length=settings.bulk_max_items
+    )
+    filter: Optional[UserFilter] = None
+    return_ids: bool = Field(
+        default=False, description="Include the affected IDs in the result"
+    )
+
+    @model_validator(mode="after")
+    def validate_selection(self):
+        if (self.ids is None) == (self.filter is None):
+            raise ValueError("Pass either ids or filter.")
+        if self.filter is not None and \
+                not self.filter.model_dump(exclude_none=True):
+            raise ValueError("The filter must set at least one field.")
+        return self
+
+
+class UserBulkUpdate(UserBulkSelection):
+    changes: UserUpdate
+
+    @model_validator(mode="after")
+    def validate_changes(self):
+        if not self.changes.model_dump(exclude_unset=True):
+            raise ValueError("No changes given.")
+        return self
+
+
+class UserBulkWriteResult(BaseModel):
+    count: int
+    ids: Optional[List[int]] = None
+
+
+class UserChangeResponse(BaseModel):
+    id: int
+    user_id: int
+    operation: Literal["create", "update", "delete"]
+    changed_at: datetime
+    # Current state of the user, null once it is deleted
+    user: Optional[UserResponse] = None
+
+
+user_change_list_adapter = TypeAdapter(List[UserChangeResponse])
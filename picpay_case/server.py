@@ -0,0 +1,92 @@
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import uvicorn
+
+from picpay_case.core.config import settings
+from picpay_case.migrations import migrate
+
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def cgroup_cpu_limit(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """
+    CPU time the cgroup may use per period, in CPUs (e.g. 1.5 for
+    `docker run --cpus 1.5`). None without a quota.
+    """
+    try:
+        # cgroup v2: "<quota> <period>", the quota is "max" when unlimited
+        quota, period = (root / "cpu.max").read_text().split()
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: the quota is -1 when unlimited
+            quota = (root / "cpu" / "cpu.cfs_quota_us").read_text().strip()
+            period = (root / "cpu" / "cpu.cfs_period_us").read_text().strip()
+        except OSError:
+            return None
+
+    try:
+        quota, period = int(quota), int(period)
+    except ValueError:
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+
+def cpu_count() -> int:
+    """
+    CPUs the process may run on, which can be fewer than the machine's
+    (e.g. a container limited with cpusets or a CPU quota)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        count = min(count, math.ceil(limit))
+    return max(1, count)
+
+
+def server_options() -> Dict[str, Any]:
+    """
+    Keyword arguments of `uvicorn.run` for the production server
+    """
+    return {
+        "host": settings.server_host,
+        "port": settings.server_port,
+        "workers": settings.server_workers or cpu_count(),
+        "loop": settings.server_loop,
+        "http": settings.server_http,
+        "backlog": settings.server_backlog,
+        "timeout_keep_alive": settings.server_keep_alive,
+        "limit_max_requests": settings.server_max_requests or None,
+        "timeout_graceful_shutdown": settings.server_graceful_timeout,
+        "proxy_headers": True,
+        "access_log": settings.server_access_log,
+    }
+
+
+def serve():
+    """
+    Runs the API with one worker process per CPU. Migrations are applied
+    once here, before the workers start, instead of by each of them.
+    """
+    if settings.auto_migrate:
+        migrate()
+        # Workers import the app (and read the settings) anew, a single
+        # worker runs in this process
+        os.environ["AUTO_MIGRATE"] = "false"
+        settings.auto_migrate = False
+
+    options = server_options()
+    if options["workers"] > 1 and "CACHE_ENABLED" not in os.environ:
+        # Each worker would cache users of its own, serving them stale for
+        # up to CACHE_TTL after another worker changes them
+        os.environ["CACHE_ENABLED"] = "false"
+    uvicorn.run("picpay_case.main:app", **options)
@@ -1,5 +1,10 @@
-from json import dumps
+import csv
+import time
+from json import dumps, loads
+from picpay_case.core.metrics import instrument_engine
+from picpay_case.main import admission
 from picpay_case.models.user import User
+from picpay_case.schemas.user import UserCreate
 from fastapi.testclient import TestClient
 
 
@@ -39,6 +44,39 @@ def test_ping_pong(api_client: TestClient):
         "Can't play ping pong without the pong"
 
 
+def test_metrics(api_client: TestClient, existing_user: User, test_db):
+    instrument_engine(test_db.get_bind())
+
+    api_client.get("/users")
+
+    response = api_client.get("/metrics")
+    assert valid_response(response)
+    assert response.headers["content-type"].startswith("text/plain")
+
+    route = 'method="GET",route="/users/"'
+    assert f'http_requests_total{{{route},status="200"}}' in response.text
+    assert f'db_statements_total{{{route}}} 1' in response.text
+
+
+def test_metrics_shed_requests(api_client: TestClient, monkeypatch):
+    """
+    Requests shed by the admission control keep the label of their route,
+    unknown paths are still unmatched
+    """
+    gate = admission.gates["write"]
+    monkeypatch.setattr(gate, "limit", 0)
+    monkeypatch.setattr(gate, "queue_size", 0)
+
+    assert api_client.post("/users", json={}).status_code == 503
+    assert api_client.get("/nowhere").status_code == 404
+
+    response = api_client.get("/metrics")
+    assert 'http_requests_total{method="POST",route="/users/",' \
+        'status="503"}' in response.text
+    assert 'http_requests_total{method="GET",route="unmatched",' \
+        'status="404"}' in response.text
+
+
 def test_create_user(api_client: TestClient, user_factory, user_op):
     new_user = user_factory()
 
@@ -58,6 +96,36 @@ def test_create_user(api_client: TestClient, user_factory, user_op):
     assert db_user is not None
 
 
+def test_create_duplicate_user(
+    api_client: TestClient, user_factory, existing_user: User
+):
+    new_user = dict(user_factory(), email=existing_user.email)
+    new_user["birthdate"] = new_user["birthdate"].isoformat()
+
+    response = api_client.post("/users", json=new_user)
+    assert response.status_code == 409
+
+
+def test_create_users_bulk(
+    api_client: TestClient, user_factory, existing_user: User
+):
+    new_users = [user_factory() for _ in range(2)]
+    new_users.append(dict(user_factory(), email=existing_user.email))
+    for u in new_users:
+        u["birthdate"] = u["birthdate"].isoformat()
+
+    response = api_client.post("/users/bulk", json=new_users)
+
+    valid_status, has_data, data = \
+        is_successfull_response_asserts(response)
+
+    assert valid_status, "Invalid Status Code received from the API"
+    assert has_data, "API returned data as None. JSON object expected"
+    assert [r.get('status') for r in data] == \
+        ["created", "created", "conflict"]
+    assert data[2].get('id') is None
+
+
 def test_list_users(api_client: TestClient, existing_users: User):
     response = api_client.get("/users")
 
@@ -73,6 +141,155 @@ def test_list_users(api_client: TestClient, existing_users: User):
     assert db_ids == ex_ids
 
 
+def test_list_users_pagination(api_client: TestClient, existing_users: User):
+    seen_ids = []
+    params = {"limit": 2}
+
+    while True:
+        response = api_client.get("/users", params=params)
+        assert valid_response(response), "Invalid Status Code received"
+
+        out = response.json()
+        seen_ids.extend(x.get('id') for x in out.get('data'))
+        if out.get('next_cursor') is None:
+            break
+        params["cursor"] = out.get('next_cursor')
+
+    ex_ids = sorted([x.id for x in existing_users])
+    assert seen_ids == ex_ids, "Pages should cover every user exactly once"
+
+
+def test_list_users_sorted_pagination(
+    api_client: TestClient, existing_users: User
+):
+    seen_ids = []
+    params = {"limit": 2, "sort": "-created_at"}
+
+    while True:
+        response = api_client.get("/users", params=params)
+        assert valid_response(response), "Invalid Status Code received"
+
+        out = response.json()
+        seen_ids.extend(x.get('id') for x in out.get('data'))
+        if out.get('next_cursor') is None:
+            break
+        params["cursor"] = out.get('next_cursor')
+
+    ex_ids = [x.id for x in sorted(
+        existing_users, key=lambda u: (u.created_at, u.id), reverse=True
+    )]
+    assert seen_ids == ex_ids, "Pages should follow the requested sort"
+
+    # A cursor only continues the sort it was built for
+    params["sort"] = "email"
+    response = api_client.get("/users", params=params)
+    assert response.status_code == 400
+
+
+def test_list_users_filters(api_client: TestClient, existing_users: User):
+    user = existing_users[0]
+    response = api_client.get("/users", params={
+        "email": user.email, "name": user.first_name[:2]
+    })
+    assert valid_response(response), "Invalid Status Code received"
+    assert [x.get('id') for x in response.json().get('data')] == [user.id]
+
+    response = api_client.get("/users", params={"sort": "phone"})
+    assert response.status_code == 422, "Only indexed fields are sortable"
+
+
+def test_users_fields_projection(
+    api_client: TestClient, existing_users: User
+):
+    response = api_client.get(
+        "/users", params={"fields": "email,id", "limit": 2}
+    )
+    assert valid_response(response), "Invalid Status Code received"
+    out = response.json()
+    assert out.get('data') == [
+        {"email": u.email, "id": u.id} for u in existing_users[:2]
+    ], "Only the requested fields should be returned"
+
+    params = {"fields": "email", "limit": 2, "cursor": out['next_cursor']}
+    response = api_client.get("/users", params=params)
+    assert [x.get('email') for x in response.json().get('data')] == \
+        [u.email for u in existing_users[2:4]]
+
+    user = existing_users[0]
+    response = api_client.get(
+        f"/users/{user.id}", params={"fields": "birthdate"}
+    )
+    assert response.json().get('data') == \
+        {"birthdate": user.birthdate.isoformat()}
+
+    response = api_client.get("/users", params={"fields": "id,password"})
+    assert response.status_code == 400
+
+
+def test_bulk_update_and_delete(
+    api_client: TestClient, existing_users: User
+):
+    ids = [u.id for u in existing_users]
+    # Caches the first user before updating it
+    api_client.get(f"/users/{ids[0]}")
+
+    response = api_client.patch("/users/bulk", json={
+        "ids": ids[:2], "changes": {"last_name": "Parceiro"}
+    })
+    assert valid_response(response), "Invalid Status Code received"
+    assert response.json().get('data') == {"count": 2, "ids": None}
+
+    response = api_client.get(f"/users/{ids[0]}")
+    assert response.json()['data']['last_name'] == "Parceiro", \
+        "Bulk updates should invalidate the cached users"
+
+    response = api_client.request("DELETE", "/users/bulk", json={
+        "filter": {"name": "parceiro"}, "return_ids": True
+    })
+    assert valid_response(response), "Invalid Status Code received"
+    assert sorted(response.json()['data']['ids']) == ids[:2]
+    assert api_client.get(f"/users/{ids[0]}").status_code == 404
+
+    for payload in (
+        {"changes": {"phone": "1"}},
+        {"ids": ids, "filter": {"name": "a"}, "changes": {"phone": "1"}},
+        {"filter": {}, "changes": {"phone": "1"}},
+        {"ids": ids, "changes": {}},
+        {"ids": ids, "changes": {"last_name": None}},
+    ):
+        response = api_client.patch("/users/bulk", json=payload)
+        assert response.status_code == 422, f"{payload} should be rejected"
+
+
+def test_list_users_invalid_page_params(api_client: TestClient):
+    response = api_client.get("/users", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+    response = api_client.get("/users", params={"limit": 10 ** 9})
+    assert response.status_code == 422
+
+
+def test_export_users_ndjson(api_client: TestClient, existing_users: User):
+    response = api_client.get(
+        "/users/export", params={"format": "ndjson", "chunk_size": 2}
+    )
+    assert valid_response(response), "Invalid Status Code received"
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+    rows = [loads(line) for line in response.text.splitlines()]
+    assert [r.get('id') for r in rows] == sorted([x.id for x in existing_users])
+
+
+def test_export_users_csv(api_client: TestClient, existing_users: User):
+    response = api_client.get("/users/export", params={"format": "csv"})
+    assert valid_response(response), "Invalid Status Code received"
+    assert response.headers["content-type"].startswith("text/csv")
+
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert [r.get('email') for r in rows] == \
+        [x.email for x in sorted(existing_users, key=lambda u: u.id)]
+
+
 def test_get_user_by_id(api_client: TestClient, existing_user: User):
     response = api_client.get(f"/users/{existing_user.id}")
 
@@ -87,6 +304,95 @@ def test_get_user_by_id(api_client: TestClient, existing_user: User):
         assert data.get(f) == getattr(existing_user, f)
 
 
+def test_get_user_by_id_cached(api_client: TestClient, existing_user: User):
+    api_client.get(f"/users/{existing_user.id}")
+    hits = api_client.get("/cache/stats").json()["hits"]
+
+    response = api_client.get(f"/users/{existing_user.id}")
+    assert valid_response(response)
+    assert api_client.get("/cache/stats").json()["hits"] == hits + 1, \
+        "Second read of the same user should be served from the cache"
+
+    # Writes through the API refresh the cached user
+    api_client.put(f"/users/{existing_user.id}", json={"first_name": "New"})
+    response = api_client.get(f"/users/{existing_user.id}")
+    assert response.json()["data"]["first_name"] == "New"
+
+    api_client.delete(f"/users/{existing_user.id}")
+    response = api_client.get(f"/users/{existing_user.id}")
+    assert response.status_code == 404
+
+
+def test_get_user_by_id_conditional(
+    api_client: TestClient, existing_user: User
+):
+    response = api_client.get(f"/users/{existing_user.id}")
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+    assert etag and last_modified, "Validators missing from the response"
+
+    response = api_client.get(
+        f"/users/{existing_user.id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304 and response.content == b""
+
+    response = api_client.get(
+        f"/users/{existing_user.id}",
+        headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+    api_client.put(f"/users/{existing_user.id}", json={"first_name": "New"})
+    response = api_client.get(
+        f"/users/{existing_user.id}", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200, "Stale ETag should not match"
+    assert response.headers.get("etag") != etag
+
+
+def test_list_users_conditional(api_client: TestClient, existing_users: User):
+    response = api_client.get("/users", params={"limit": 3})
+    etag = response.headers.get("etag")
+    assert etag, "ETag missing from the response"
+
+    response = api_client.get(
+        "/users", params={"limit": 3}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    api_client.put(f"/users/{existing_users[1].id}", json={"last_name": "X"})
+    response = api_client.get(
+        "/users", params={"limit": 3}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200, "Page changed, ETag should not match"
+
+
+def test_list_users_conditional_deleted_row(
+    api_client: TestClient, user_op, user_factory
+):
+    # Created newest first by email, so the page sorted by email starts
+    # with the newest user and the highest ID
+    users = [
+        user_op.create_user(UserCreate(**user_factory(email=email)))
+        for email in (
+            "d@example.com", "c@example.com", "b@example.com",
+            "a@example.com"
+        )
+    ]
+    params = {"limit": 2, "sort": "email"}
+    etag = api_client.get("/users", params=params).headers.get("etag")
+
+    # The page (and its extra row) loses "b" and gains the older "d":
+    # same count, last update and last ID
+    api_client.delete(f"/users/{users[2].id}")
+    response = api_client.get(
+        "/users", params=params, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200, "Page changed, ETag should not match"
+    assert [u["email"] for u in response.json()["data"]] == \
+        ["a@example.com", "c@example.com"]
+
+
 def test_update_user_by_id(
     api_client: TestClient, existing_user: User, fake_data
 ):
@@ -112,6 +418,97 @@ def test_update_user_by_id(
             f"Updated field `{k}` differs. {v} != {getattr(existing_user, k)}"
 
 
+def test_update_user_null_field(api_client: TestClient, existing_user: User):
+    response = api_client.put(
+        f"/users/{existing_user.id}", json={"first_name": None}
+    )
+    assert response.status_code == 422, "Required fields can't be nulled"
+
+
 def test_delete_user_by_id(api_client: TestClient, existing_user: User):
     response = api_client.delete(f"/users/{existing_user.id}")
     assert valid_response(response), "Non success status code received"
+
+
+def test_users_async_mode(async_api_client: TestClient, user_factory):
+    new_user = user_factory()
+    new_user["birthdate"] = new_user["birthdate"].isoformat()
+
+    response = async_api_client.post("/users", json=new_user)
+    assert response.status_code == 201
+    user_id = response.json()["data"]["id"]
+
+    response = async_api_client.get(f"/users/{user_id}")
+    assert valid_response(response)
+    assert response.json()["data"]["email"] == new_user["email"]
+
+    response = async_api_client.put(
+        f"/users/{user_id}", json={"first_name": "Async"}
+    )
+    assert response.json()["data"]["first_name"] == "Async"
+
+    response = async_api_client.get("/users/export")
+    assert [loads(x)["id"] for x in response.text.splitlines()] == [user_id]
+
+    response = async_api_client.delete(f"/users/{user_id}")
+    assert response.status_code == 204
+    assert async_api_client.get(f"/users/{user_id}").status_code == 404
+
+
+def test_change_feed(api_client: TestClient, user_factory):
+    """
+    This test follows the change feed through its cursor and validates
+    that an idle long-poll returns no change after `wait`
+    """
+    created = [
+        api_client.post("/users", json=dict(
+            user_factory(), birthdate="1990-01-01"
+        )).json()["data"]
+        for _ in range(3)
+    ]
+    api_client.delete(f"/users/{created[0]['id']}")
+
+    response = api_client.get("/users/changes", params={"limit": 3})
+    assert response.status_code == 200
+    changes = response.json()["data"]
+    assert [c["operation"] for c in changes] == ["create"] * 3
+    assert changes[0]["user"] is None, "Deleted users have no state"
+    assert changes[1]["user"]["email"] == created[1]["email"]
+
+    cursor = response.json()["next_cursor"]
+    response = api_client.get("/users/changes", params={"since": cursor})
+    assert [c["operation"] for c in response.json()["data"]] == ["delete"]
+
+    cursor = response.json()["next_cursor"]
+    start = time.monotonic()
+    response = api_client.get(
+        "/users/changes", params={"since": cursor, "wait": 0.2}
+    )
+    assert time.monotonic() - start >= 0.2, "The request should wait"
+    assert response.json()["next_cursor"] == cursor
+    assert response.json()["data"] == [], "An empty feed is an empty list"
+
+
+def test_change_feed_empty(api_client: TestClient):
+    response = api_client.get("/users/changes")
+    assert response.status_code == 200
+    assert response.json()["data"] == []
+    assert response.json()["next_cursor"] == "0"
+
+
+def test_change_feed_compacted_cursor(api_client: TestClient, user_op,
+                                      user_factory):
+    """
+    This test validates that a cursor behind the compaction horizon gets a
+    410 with the cursor to resume from
+    """
+    user_op.create_user(UserCreate(**user_factory()))
+    user_op.create_user(UserCreate(**user_factory()))
+    user_op.compact_changes(retention=-1)
+
+    response = api_client.get("/users/changes", params={"since": 0})
+    assert response.status_code == 410
+    assert response.json()["detail"]["cursor"] == "2"
+
+    response = api_client.get("/users/changes/stream", params={"since": 1})
+    assert response.status_code == 410
@@ -0,0 +1,141 @@
+import asyncio
+
+from picpay_case.api.changes import poll_changes
+from picpay_case.api.middleware.admission import (
+    AdmissionController, AdmissionMiddleware, AdmissionSlot, ConcurrencyGate,
+    TokenBuckets
+)
+from picpay_case.core.config import settings
+
+
+def test_gate_queues_then_rejects():
+    """
+    This test validates that the gate queues requests over its limit in
+    order, and rejects them when the queue is full or the deadline passes
+    """
+    gate = ConcurrencyGate(limit=1, queue_size=1, timeout=0.05)
+
+    async def _run():
+        assert await gate.acquire()
+        queued = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert await gate.acquire() is False, "The queue is full"
+
+        gate.release()
+        assert await queued, "The slot should go to the waiting request"
+        assert await gate.acquire() is False, "The deadline should pass"
+        gate.release()
+        return gate.active, gate.queued, gate.rejected
+
+    assert asyncio.run(_run()) == (0, 0, 2)
+
+
+def test_token_buckets():
+    buckets = TokenBuckets(rate=10, burst=2)
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == 0
+    assert 0 < buckets.take("a") <= 0.1
+    assert buckets.take("b") == 0, "Each client has its own bucket"
+
+
+def _call(app, path: str, method: str = "GET", client: str = "1.2.3.4"):
+    scope = {
+        "type": "http", "method": method, "path": path, "headers": [],
+        "client": (client, 5000),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def _run():
+        await app(scope, receive, send)
+        return messages[0]["status"], dict(messages[0]["headers"])
+
+    return _run()
+
+
+def test_middleware_sheds_load():
+    """
+    This test saturates the write gate and validates the fast 503 with
+    Retry-After, while reads, health checks and other clients' requests
+    still go through
+    """
+    async def app(scope, receive, send):
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    controller = AdmissionController(
+        read_limit=1, write_limit=1, queue_size=0, retry_after=2,
+        rate=1, burst=3
+    )
+    middleware = AdmissionMiddleware(app, controller)
+
+    async def _run():
+        writes = await asyncio.gather(
+            _call(middleware, "/users/", "POST"),
+            _call(middleware, "/users/", "POST"),
+            _call(middleware, "/users/1"),
+            _call(middleware, "/health"),
+        )
+        limited = await _call(middleware, "/users/1")
+        other = await _call(middleware, "/users/1", client="5.6.7.8")
+        changes = await asyncio.gather(
+            _call(middleware, "/users/changes", client="9.9.9.9"),
+            _call(middleware, "/users/changes", client="9.9.9.9"),
+        )
+        return writes, limited, other, changes
+
+    (first, shed, read, health), limited, other, changes = \
+        asyncio.run(_run())
+
+    assert first[0] == 200 and read[0] == 200 and health[0] == 200
+    assert shed == (503, {
+        b"content-type": b"application/json",
+        b"content-length": shed[1][b"content-length"],
+        b"retry-after": b"2",
+    })
+    assert limited[0] == 429 and limited[1][b"retry-after"] == b"1"
+    assert other[0] == 200
+    assert sorted(c[0] for c in changes) == [200, 503], \
+        "Change feed reads are limited like the other reads"
+    assert controller.stats()[("write", "rejected")] == 1
+
+
+def test_long_poll_releases_its_slot(monkeypatch):
+    """
+    This test validates that a change feed long-poll only holds its slot
+    while it reads the feed, and ends empty when it can't take it back
+    """
+    monkeypatch.setattr(settings, "change_feed_poll_interval", 0.01)
+    reads = []
+
+    class _Feed:
+        async def get_changes(self, since, limit):
+            reads.append(gate.active)
+            return []
+
+        async def close(self):
+            pass
+
+    gate = ConcurrencyGate(limit=1, queue_size=0, timeout=0.01)
+
+    async def _run():
+        assert await gate.acquire()
+        slot = AdmissionSlot(gate)
+        poll = asyncio.create_task(
+            poll_changes(_Feed(), 0, 10, 0.1, slot)
+        )
+        await asyncio.sleep(0.005)
+        assert await gate.acquire(), "The waiting poll should free its slot"
+        changes = await poll
+        gate.release()
+        return changes, slot.held
+
+    assert asyncio.run(_run()) == ([], False)
+    assert reads == [1], "The feed should only be read holding the slot"
@@ -0,0 +1,61 @@
+import gzip
+
+from fastapi.testclient import TestClient
+
+from picpay_case.api.middleware.compression import choose_encoding
+from picpay_case.schemas.user import UserCreate
+
+
+def test_choose_encoding():
+    """
+    This test validates the negotiation of Accept-Encoding q-values
+    """
+    encodings = ["zstd", "br", "gzip"]
+    assert choose_encoding("gzip, br", encodings) == "br"
+    assert choose_encoding("br;q=0.5, gzip", encodings) == "gzip"
+    assert choose_encoding("*;q=0.1, zstd;q=0", encodings) == "br"
+    assert choose_encoding("gzip;q=0, identity", encodings) is None
+    assert choose_encoding("", encodings) is None
+
+
+def test_compresses_large_responses(api_client: TestClient, user_op,
+                                    user_factory):
+    """
+    This test validates that a large listing is compressed and a small
+    response is sent as is
+    """
+    for _ in range(20):
+        user_op.create_user(UserCreate(**user_factory()))
+
+    response = api_client.get("/users", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.headers["etag"].startswith("W/")
+    assert len(response.json()["data"]) == 20
+
+    response = api_client.get("/ping", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+    response = api_client.get(
+        "/users", headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+
+
+def test_compresses_streams(api_client: TestClient, user_op, user_factory):
+    """
+    This test validates that a streamed export is compressed chunk by
+    chunk into one valid gzip stream
+    """
+    for _ in range(3):
+        user_op.create_user(UserCreate(**user_factory()))
+
+    with api_client.stream(
+        "GET", "/users/export", params={"format": "ndjson"},
+        headers={"Accept-Encoding": "gzip"}
+    ) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+
+    assert len(gzip.decompress(raw).splitlines()) == 3
@@ -0,0 +1,130 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from picpay_case.api.middleware.admission import AdmissionMiddleware
+from picpay_case.api.middleware.idempotency import IdempotencyMiddleware
+from picpay_case.core.cache import LRUCache
+from picpay_case.main import app as main_app
+from picpay_case.operations.idempotency import IdempotencyStore
+
+
+def _post(api_client: TestClient, user: dict, key: str):
+    return api_client.post(
+        "/users/", json=user, headers={"Idempotency-Key": key}
+    )
+
+
+def test_retries_get_the_first_response(api_client: TestClient, user_op,
+                                        user_factory):
+    """
+    This test retries a user creation with the same Idempotency-Key and
+    validates it gets the original 201 instead of a 409
+    """
+    user = dict(user_factory(), birthdate="1990-01-01")
+
+    first = _post(api_client, user, "retry-1")
+    retry = _post(api_client, user, "retry-1")
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert len(user_op.get_users()) == 1
+
+    assert _post(api_client, user, "retry-2").status_code == 409, \
+        "Another key is another request"
+    assert _post(api_client, dict(user, first_name="Outro"), "retry-1") \
+        .status_code == 422, "A key can't be reused with another body"
+
+
+def _request(app, key: str = "key"):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/users/",
+        "headers": [(b"idempotency-key", key.encode())],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def _call():
+        await app(scope, receive, send)
+        return messages[0]["status"], messages[1]["body"]
+
+    return _call()
+
+
+def test_concurrent_duplicates_wait_for_the_first():
+    """
+    This test sends duplicates while the first request runs, and validates
+    that the app runs once and server errors aren't replayed
+    """
+    calls = []
+
+    async def app(scope, receive, send):
+        await receive()
+        calls.append(scope["path"])
+        await asyncio.sleep(0.05)
+        status = 500 if len(calls) == 1 else 201
+        await send({"type": "http.response.start", "status": status,
+                    "headers": []})
+        await send({"type": "http.response.body",
+                    "body": str(len(calls)).encode()})
+
+    middleware = IdempotencyMiddleware(app, LRUCache())
+
+    async def _run():
+        failed = await _request(middleware)
+        duplicates = await asyncio.gather(
+            *[_request(middleware) for _ in range(5)]
+        )
+        return failed, duplicates
+
+    failed, duplicates = asyncio.run(_run())
+
+    assert failed == (500, b"1")
+    assert duplicates == [(201, b"2")] * 5
+    assert len(calls) == 2
+    assert middleware.replayed == 4
+
+
+def test_workers_share_the_stored_responses(test_db):
+    """
+    This test sends a retry to another worker (middleware instance) sharing
+    the database store, and validates it gets the first response back
+    """
+    calls = []
+
+    async def app(scope, receive, send):
+        await receive()
+        calls.append(scope["path"])
+        await send({"type": "http.response.start", "status": 201,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"id": 1}'})
+
+    store = IdempotencyStore(sessionmaker(bind=test_db.get_bind()))
+    workers = [IdempotencyMiddleware(app, store) for _ in range(2)]
+
+    first = asyncio.run(_request(workers[0]))
+    retry = asyncio.run(_request(workers[1]))
+
+    assert first == retry == (201, b'{"id": 1}')
+    assert len(calls) == 1, "The retry ran the request again"
+    assert workers[1].replayed == 1
+
+
+def test_admission_runs_before_the_store():
+    """
+    This test validates that shed requests never reach the idempotency
+    store, whose queries hit the database
+    """
+    # Outermost first
+    stack = [m.cls for m in main_app.user_middleware]
+    assert stack.index(AdmissionMiddleware) < \
+        stack.index(IdempotencyMiddleware)
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from picpay_case.api.formats import JSON, MSGPACK, negotiate
+from picpay_case.models.user import User
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def test_negotiate():
+    """
+    This test validates that MessagePack is only used when the client
+    prefers it over JSON
+    """
+    assert negotiate("application/msgpack") == MSGPACK
+    assert negotiate("application/x-msgpack, */*;q=0.1") == MSGPACK
+    assert negotiate("application/json, application/msgpack") == JSON
+    assert negotiate("application/msgpack;q=0.5, */*") == JSON
+    assert negotiate("") == JSON
+
+
+def test_msgpack_responses(api_client: TestClient, existing_user: User):
+    """
+    This test reads a user as MessagePack and validates the envelope, the
+    timestamps and that the ETag depends on the format
+    """
+    url = f"/users/{existing_user.id}"
+    response = api_client.get(url, headers={"Accept": MSGPACK})
+    assert response.headers["content-type"] == MSGPACK
+    assert "Accept" in response.headers["vary"]
+
+    body = msgpack.unpackb(response.content, timestamp=3)
+    assert body["data"]["email"] == existing_user.email
+    assert body["data"]["birthdate"] == \
+        existing_user.birthdate.isoformat()
+    assert isinstance(body["data"]["created_at"], datetime)
+    assert body["message"] == "Operation successfull"
+
+    assert response.headers["etag"] != api_client.get(url).headers["etag"]
+
+
+def test_msgpack_request_bodies(api_client: TestClient, user_factory):
+    """
+    This test creates users with MessagePack bodies
+    """
+    user = user_factory()
+    user["birthdate"] = user["birthdate"].isoformat()
+
+    response = api_client.post(
+        "/users", content=msgpack.packb(user),
+        headers={"Content-Type": MSGPACK, "Accept": MSGPACK}
+    )
+    assert response.status_code == 201
+    assert msgpack.unpackb(response.content)["data"]["email"] == \
+        user["email"]
+
+    response = api_client.post(
+        "/users/bulk", content=msgpack.packb([dict(user, email="x")]),
+        headers={"Content-Type": MSGPACK}
+    )
+    assert response.status_code == 422, "Bodies should still be validated"
+
+    response = api_client.post(
+        "/users", content=b"\xc1", headers={"Content-Type": MSGPACK}
+    )
+    assert response.status_code == 400
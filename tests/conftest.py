@@ -4,17 +4,25 @@ from faker import Faker
 from typing import List
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import StaticPool
-from picpay_case.models.user import User, Base
+from picpay_case.models.user import User
 from picpay_case.schemas.user import UserCreate
 from picpay_case.operations.user import UserOperations
+from picpay_case.operations.async_user import (
+    AsyncUserOperations, user_cache
+)
 
+from picpay_case.core.config import settings
 from picpay_case.database import get_db
+from picpay_case.api.deps import get_user_operations
+from picpay_case.migrations import migrate
 
 from fastapi.testclient import TestClient
 
-from picpay_case.main import app
+from picpay_case.main import app, idempotency_store
+from tests.factories import make_user_data
 
 
 @pytest.fixture(scope="session")
@@ -24,14 +32,8 @@ def fake_data():
 
 @pytest.fixture
 def user_factory(fake_data):
-    def _create_user_data():
-        return dict(
-            first_name=fake_data.first_name(),
-            last_name=fake_data.last_name(),
-            email=fake_data.email(),
-            birthdate=fake_data.date_of_birth(),
-            phone=fake_data.phone_number()
-        )
+    def _create_user_data(**overrides):
+        return {**make_user_data(fake_data), **overrides}
     return _create_user_data
 
 
@@ -46,11 +48,12 @@ def test_db() -> Session:
     )
 
     # Create all tables
-    Base.metadata.create_all(bind=engine)
+    migrate(engine)
 
     db = sessionmaker(
         autocommit=False,
         autoflush=False,
+        expire_on_commit=False,
         bind=engine
     )()
 
@@ -60,12 +63,31 @@ def test_db() -> Session:
         db.close()
 
 
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    """
+    Each test has its own database, don't serve users cached by another
+    """
+    if user_cache is not None:
+        user_cache.clear()
+
+
 @pytest.fixture
-def api_client(test_db) -> TestClient:
+def api_client(test_db, monkeypatch) -> TestClient:
     """
     Fixture for defining a client used by the api tests
     """
 
+    # The test database is migrated by `test_db`, skip the real one
+    monkeypatch.setattr(settings, "auto_migrate", False)
+
+    # Idempotency keys are stored in the test database too
+    if idempotency_store is not None:
+        monkeypatch.setattr(
+            idempotency_store, "session_factory",
+            sessionmaker(bind=test_db.get_bind())
+        )
+
     # Override the get_db function to use the fixture for in-memory db
     def override_get_db():
         yield test_db
@@ -78,6 +100,43 @@ def api_client(test_db) -> TestClient:
     app.dependency_overrides.clear()
 
 
+@pytest.fixture
+def async_session_factory(tmp_path):
+    """
+    Fixture for an async session factory (aiosqlite) on a migrated database
+    """
+    db_path = tmp_path / "async.sqlite"
+    engine = create_engine(f"sqlite:///{db_path}")
+    migrate(engine)
+    engine.dispose()
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    yield async_sessionmaker(
+        autoflush=False, expire_on_commit=False, bind=async_engine
+    )
+    async_engine.sync_engine.dispose()
+
+
+@pytest.fixture
+def async_api_client(async_session_factory, monkeypatch) -> TestClient:
+    """
+    Fixture for a client served by the async operations (ASYNC_DB mode)
+    """
+    monkeypatch.setattr(settings, "auto_migrate", False)
+
+    async def override_get_user_operations():
+        async with async_session_factory() as db:
+            yield AsyncUserOperations(db)
+
+    app.dependency_overrides[get_user_operations] = \
+        override_get_user_operations
+
+    with TestClient(app) as client:
+        yield client
+
+    app.dependency_overrides.clear()
+
+
 @pytest.fixture
 def user_op(test_db) -> UserOperations:
     """
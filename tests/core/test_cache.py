@@ -0,0 +1,100 @@
+import asyncio
+
+from picpay_case.core.cache import LRUCache, ReadThroughCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """
+    This test fills the cache over its size and validates the eviction
+    """
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+
+    assert cache.get(2) is None, "Least recently used entry was not evicted"
+    assert cache.get(1) == "a" and cache.get(3) == "c"
+
+
+def test_lru_cache_expires_entries():
+    """
+    This test validates that entries are dropped after their TTL
+    """
+    cache = LRUCache(max_size=2, ttl=0)
+    cache.set(1, "a")
+
+    assert cache.get(1) is None, "Expired entry was returned"
+    assert len(cache) == 0
+
+
+def test_read_through_cache_single_flight():
+    """
+    This test sends concurrent misses for the same key and validates that
+    only one of them loads the value
+    """
+    cache = ReadThroughCache(LRUCache())
+    loads = []
+
+    async def _loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def _get_many():
+        return await asyncio.gather(
+            *[cache.get_or_load("key", _loader) for _ in range(10)]
+        )
+
+    values = asyncio.run(_get_many())
+
+    assert values == ["value"] * 10
+    assert len(loads) == 1, "Concurrent misses were not coalesced"
+    assert asyncio.run(cache.get_or_load("key", _loader)) == "value"
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 9, "size": 1}
+
+
+def test_read_through_cache_invalidate_during_load():
+    """
+    This test invalidates a key while it is loading and validates that the
+    stale loaded value is not stored
+    """
+    cache = ReadThroughCache(LRUCache())
+
+    async def _loader():
+        cache.invalidate("key")
+        return "stale"
+
+    assert asyncio.run(cache.get_or_load("key", _loader)) == "stale"
+    assert cache.backend.get("key") is None, "Stale value was cached"
+
+
+def test_read_through_cache_cancelled_loader():
+    """
+    This test cancels the request loading a key and validates that the
+    requests waiting for it load the value instead of being cancelled
+    """
+    cache = ReadThroughCache(LRUCache())
+    loads = []
+
+    async def _loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def _run():
+        leader = asyncio.create_task(cache.get_or_load("key", _loader))
+        await asyncio.sleep(0)
+        waiters = [
+            asyncio.create_task(cache.get_or_load("key", _loader))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await asyncio.gather(*waiters), leader.cancelled()
+
+    values, leader_cancelled = asyncio.run(_run())
+
+    assert leader_cancelled
+    assert values == ["value"] * 3
+    assert len(loads) == 2, "One of the waiters should load again"
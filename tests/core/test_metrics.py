@@ -0,0 +1,39 @@
+from picpay_case.core.metrics import MetricsRegistry, RequestStats
+
+
+def test_registry_renders_prometheus_text():
+    """
+    This test records requests and validates the exposition output
+    """
+    registry = MetricsRegistry()
+    registry.observe_request(
+        "GET", "/users/{user_id}", 200, 0.003, RequestStats(2, 0.001)
+    )
+    registry.observe_request(
+        "GET", "/users/{user_id}", 404, 0.2, RequestStats(1, 0.0005)
+    )
+    registry.observe_checkout(0.0002)
+
+    text = registry.render()
+
+    route = 'method="GET",route="/users/{user_id}"'
+    assert f'http_requests_total{{{route},status="200"}} 1' in text
+    assert f'http_requests_total{{{route},status="404"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{route},le="0.005"}} 1' \
+        in text
+    assert f'http_request_duration_seconds_count{{{route}}} 2' in text
+    assert f'db_statements_total{{{route}}} 3' in text
+    assert 'db_pool_checkout_seconds_count 1' in text
+
+
+def test_registry_gauges():
+    """
+    This test validates that gauges are collected when rendering
+    """
+    registry = MetricsRegistry()
+    registry.register_gauge(
+        "cache_stats", "Cache stats", lambda: {("hits",): 3},
+        label_names=("event",)
+    )
+
+    assert 'cache_stats{event="hits"} 3' in registry.render()
@@ -0,0 +1,22 @@
+import asyncio
+import threading
+
+from picpay_case.core.notifier import ChangeNotifier
+
+
+def test_notify_wakes_waiters():
+    """
+    This test validates that a notify from another thread wakes every
+    waiter, and that a wait without notify times out
+    """
+    notifier = ChangeNotifier()
+
+    async def _wait():
+        assert await notifier.wait(0.01) is False
+
+        waiters = [asyncio.create_task(notifier.wait(5)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        threading.Thread(target=notifier.notify).start()
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(_wait()) == [True] * 3
@@ -0,0 +1,52 @@
+from picpay_case.core.metrics import RequestStats, request_stats
+from picpay_case.core.profiler import QueryProfiler, fingerprint, is_full_scan
+
+
+def test_fingerprint_normalizes_literals_and_lists():
+    """
+    This test validates that statements differing only in literals and
+    list lengths share a fingerprint
+    """
+    assert fingerprint(
+        "SELECT * FROM users WHERE id IN (?, ?, ?) AND email = 'a@b.c'"
+    ) == fingerprint(
+        "SELECT *  FROM users\n WHERE id IN (?) AND email = 'x'"
+    )
+    assert fingerprint("INSERT INTO t (a, b) VALUES (?, ?), (?, ?)") == \
+        "INSERT INTO t (a, b) VALUES (?, ?), ..."
+
+
+def test_is_full_scan():
+    assert is_full_scan(["SCAN users"])
+    assert not is_full_scan(["SEARCH users USING INTEGER PRIMARY KEY"])
+    assert not is_full_scan(["SCAN users USING INDEX ix_users_email"])
+
+
+def test_profiler_plans_and_flags(user_op, existing_users):
+    """
+    This test profiles the user operations and validates the captured
+    plans, the slow query log and the repeated statement detection
+    """
+    profiler = QueryProfiler(slow_query_ms=0, repeat_threshold=3)
+    profiler.attach(user_op.db.get_bind())
+
+    token = request_stats.set(RequestStats())
+    try:
+        for u in existing_users:
+            user_op.get_user(u.id)
+        list(user_op.iter_users())
+    finally:
+        request_stats.reset(token)
+
+    report = profiler.snapshot()
+    by_statement = {s["statement"]: s for s in report["statements"]}
+
+    get_user = next(s for k, s in by_statement.items() if "WHERE" in k)
+    assert get_user["calls"] == len(existing_users)
+    assert not get_user["full_scan"] and get_user["plan"]
+    assert get_user["repeated_requests"] == 1, \
+        "Statement repeated within the request was not flagged"
+
+    assert any("ORDER BY users.id" in s for s in report["full_scans"]), \
+        "Export without a WHERE clause should be flagged as a full scan"
+    assert report["slow_queries"] and report["slow_queries"][0]["plan"]
@@ -0,0 +1,120 @@
+import asyncio
+import shutil
+
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.exc import OperationalError
+
+from picpay_case.core.replicas import ReplicaRouter, RoutingSession
+from picpay_case.migrations import migrate
+from picpay_case.models.user import User
+from picpay_case.operations.async_user import ThreadPoolUserOperations
+from picpay_case.operations.user import UserOperations
+from picpay_case.schemas.user import UserCreate, UserUpdate
+
+
+@pytest.fixture
+def databases(tmp_path, user_factory):
+    """
+    A primary with one user and two replicas copied from it, where the
+    user has another first name so reads show which database served them
+    """
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.sqlite'}")
+    migrate(primary)
+    with RoutingSession(bind=primary, expire_on_commit=False) as db:
+        user = UserOperations(db).create_user(UserCreate(**user_factory()))
+    primary.dispose()
+
+    replicas = []
+    for name in ("replica1", "replica2"):
+        path = tmp_path / f"{name}.sqlite"
+        shutil.copy(tmp_path / "primary.sqlite", path)
+        replica = create_engine(f"sqlite:///{path}")
+        with replica.begin() as conn:
+            conn.execute(update(User).values(first_name=name))
+        replicas.append(replica)
+
+    yield primary, replicas, user.id
+    for replica in replicas:
+        replica.dispose()
+
+
+def test_reads_round_robin_over_replicas(databases):
+    """
+    This test validates that each session reads from one replica, taking
+    turns between sessions
+    """
+    primary, replicas, user_id = databases
+    router = ReplicaRouter(primary, replicas)
+
+    names = []
+    for _ in range(4):
+        with RoutingSession(bind=primary, router=router) as db:
+            names.append(UserOperations(db).get_user(user_id).first_name)
+            db.expire_all()
+            assert UserOperations(db).get_user(user_id).first_name \
+                == names[-1], "A session should stick to its replica"
+
+    assert names == ["replica1", "replica2"] * 2
+
+
+def test_reads_after_write_go_to_primary(databases):
+    """
+    This test validates that a session reads its own writes
+    """
+    primary, replicas, user_id = databases
+    router = ReplicaRouter(primary, replicas)
+
+    with RoutingSession(bind=primary, router=router) as db:
+        user_op = UserOperations(db)
+        assert user_op.get_user(user_id).first_name.startswith("replica")
+
+        user_op.update_user(user_id, UserUpdate(last_name="Primario"))
+        assert user_op.get_user(user_id).last_name == "Primario", \
+            "Reads after a write should be served by the primary"
+
+
+def test_writes_read_from_primary(databases, user_factory):
+    """
+    This test validates that the reads a write makes before writing (the
+    email check of a bulk create) are served by the primary
+    """
+    primary, replicas, _ = databases
+    router = ReplicaRouter(primary, replicas)
+    # Not replicated yet
+    with RoutingSession(bind=primary, expire_on_commit=False) as db:
+        lagging = UserOperations(db).create_user(UserCreate(**user_factory()))
+
+    with RoutingSession(bind=primary, router=router) as db:
+        user_op = ThreadPoolUserOperations(UserOperations(db))
+        ids = asyncio.run(user_op.create_users(
+            [UserCreate(**user_factory(email=lagging.email))]
+        ))
+
+    assert ids == [None], "The email taken on the primary should be seen"
+
+
+def test_failing_replica_falls_back(databases, tmp_path):
+    """
+    This test marks a replica down after an error, falls back to the
+    primary and uses the replica again once its probe succeeds
+    """
+    primary, replicas, user_id = databases
+    broken = create_engine(f"sqlite:///{tmp_path / 'empty.sqlite'}")
+    router = ReplicaRouter(primary, [broken], retry_after=60)
+
+    with RoutingSession(bind=primary, router=router) as db:
+        with pytest.raises(OperationalError):
+            UserOperations(db).get_user(user_id)
+
+    with RoutingSession(bind=primary, router=router) as db:
+        user = UserOperations(db).get_user(user_id)
+        assert not user.first_name.startswith("replica"), \
+            "Reads should fall back to the primary while the replica is down"
+
+    router.replicas = replicas[:1]
+    router.retry_after = 0
+    router.mark_down(replicas[0])
+    with RoutingSession(bind=primary, router=router) as db:
+        assert UserOperations(db).get_user(user_id).first_name == "replica1"
+    broken.dispose()
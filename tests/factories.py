@@ -0,0 +1,15 @@
+from faker import Faker
+
+
+def make_user_data(fake: Faker) -> dict:
+    """
+    Builds the payload of a random user, shared by the test fixtures and
+    the benchmark seeding
+    """
+    return dict(
+        first_name=fake.first_name(),
+        last_name=fake.last_name(),
+        email=fake.email(),
+        birthdate=fake.date_of_birth(),
+        phone=fake.phone_number()
+    )
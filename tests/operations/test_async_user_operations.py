@@ -0,0 +1,51 @@
+import asyncio
+
+from picpay_case.operations.async_user import AsyncUserOperations
+from picpay_case.schemas.user import UserCreate, UserUpdate
+
+
+def test_async_crud(async_session_factory, user_factory):
+    """
+    This test runs a create/read/update/delete cycle on an AsyncSession
+    """
+    async def _crud():
+        async with async_session_factory() as db:
+            user_op = AsyncUserOperations(db)
+
+            created = await user_op.create_user(UserCreate(**user_factory()))
+            assert created is not None and created.id is not None, \
+                "create_user didn't return the created user"
+
+            db_user = await user_op.get_user(created.id)
+            assert db_user.email == created.email, \
+                "The created and the retrieved user don't match"
+
+            updated = await user_op.update_user(
+                created.id, UserUpdate(first_name="Async")
+            )
+            assert updated.first_name == "Async", "User was not updated"
+
+            assert await user_op.delete_user(created.id) is True
+            assert await user_op.get_user(created.id) is None, \
+                "User still exists in the database after deletion"
+
+    asyncio.run(_crud())
+
+
+def test_async_iter_users(async_session_factory, user_factory):
+    """
+    This test streams users in chunks through the async driver
+    """
+    async def _iter():
+        async with async_session_factory() as db:
+            user_op = AsyncUserOperations(db)
+            ids = await user_op.create_users(
+                [UserCreate(**user_factory()) for _ in range(5)]
+            )
+            chunks = [c async for c in user_op.iter_users(chunk_size=2)]
+            return ids, chunks
+
+    ids, chunks = asyncio.run(_iter())
+
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert [u.id for c in chunks for u in c] == ids
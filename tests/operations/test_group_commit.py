@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from picpay_case.migrations import migrate
+from picpay_case.operations import async_user
+from picpay_case.operations.async_user import ThreadPoolUserOperations
+from picpay_case.operations.group_commit import WriteCoordinator
+from picpay_case.operations.user import UserConflictError, UserOperations
+from picpay_case.schemas.user import UserCreate, UserUpdate
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'group.sqlite'}",
+        connect_args={"check_same_thread": False}
+    )
+    migrate(engine)
+    yield sessionmaker(
+        autoflush=False, expire_on_commit=False, bind=engine
+    )
+    engine.dispose()
+
+
+@pytest.fixture
+def coordinator(session_factory):
+    coordinator = WriteCoordinator(session_factory, window=0.05)
+    yield coordinator
+    coordinator.close()
+
+
+def test_group_commit_batches_writes(coordinator, session_factory,
+                                     user_factory):
+    """
+    This test submits concurrent writes and validates that they share
+    transactions while each caller gets its own result or error
+    """
+    users = [UserCreate(**user_factory()) for _ in range(10)]
+
+    async def _write():
+        created = await asyncio.gather(*[
+            coordinator.submit("create_user", u) for u in users
+        ])
+        results = await asyncio.gather(
+            coordinator.submit("create_user", users[0]),
+            coordinator.submit(
+                "update_user", created[1].id, UserUpdate(first_name="Grupo")
+            ),
+            coordinator.submit(
+                "update_user", created[2].id, UserUpdate(email=users[3].email)
+            ),
+            coordinator.submit("delete_user", created[4].id),
+            return_exceptions=True
+        )
+        return created, results
+
+    created, (duplicate, updated, conflict, deleted) = \
+        asyncio.run(_write())
+
+    assert all(u is not None for u in created), "Every user should be created"
+    assert coordinator.writes == 14
+    assert coordinator.batches < coordinator.writes, \
+        "Concurrent writes should be committed together"
+
+    assert duplicate is None, "A duplicate email should only fail its write"
+    assert updated.first_name == "Grupo"
+    assert isinstance(conflict, UserConflictError)
+    assert deleted is True
+
+    with session_factory() as db:
+        user_op = UserOperations(db)
+        assert user_op.get_user(created[1].id).first_name == "Grupo"
+        assert user_op.get_user(created[2].id).email == users[2].email, \
+            "The failed write should be rolled back alone"
+        assert user_op.get_user(created[4].id) is None
+        assert len(user_op.get_users()) == 9
+
+
+def test_facade_writes_through_coordinator(coordinator, session_factory,
+                                           user_factory, monkeypatch):
+    """
+    This test validates that the endpoints' operations submit single-user
+    writes to the coordinator when group commit is enabled
+    """
+    monkeypatch.setattr(async_user, "write_coordinator", coordinator)
+
+    async def _create():
+        with session_factory() as db:
+            user_op = ThreadPoolUserOperations(UserOperations(db))
+            return await user_op.create_user(UserCreate(**user_factory()))
+
+    user = asyncio.run(_create())
+
+    assert user is not None and user.id is not None
+    assert coordinator.writes == 1, "The write should go through the batch"
@@ -0,0 +1,54 @@
+from sqlalchemy.orm import sessionmaker
+
+from picpay_case.api.middleware.idempotency import StoredResponse
+from picpay_case.operations.idempotency import IdempotencyStore
+
+KEY = ("POST", "/users/", "key")
+
+
+def test_idempotency_store(test_db):
+    """
+    This test validates that the first stored response of a key wins and
+    that expired ones are ignored, replaced and purged
+    """
+    store = IdempotencyStore(sessionmaker(bind=test_db.get_bind()))
+    first = StoredResponse(
+        "a" * 64, 201, [(b"content-type", b"application/json")], b"{}"
+    )
+
+    store.set(KEY, first)
+    store.set(KEY, first._replace(status=409))
+
+    assert store.get(KEY) == first, "The first response should be kept"
+    assert store.get(("PUT", "/users/", "key")) is None
+    assert len(store) == 1
+
+    store.ttl = 0
+    store.set(("POST", "/users/", "old"), first)
+    assert store.get(("POST", "/users/", "old")) is None, \
+        "Expired responses should not be replayed"
+    store.set(("POST", "/users/", "old"), first)
+
+    assert store.purge_expired() == 1
+    assert store.get(KEY) == first
+
+
+def test_idempotency_store_bounds(test_db):
+    """
+    This test validates that the oldest keys are evicted past `max_keys`
+    and that bodies over `max_body_size` aren't stored
+    """
+    store = IdempotencyStore(
+        sessionmaker(bind=test_db.get_bind()), max_keys=2, max_body_size=10
+    )
+    response = StoredResponse("a" * 64, 201, [], b"{}")
+    keys = [("POST", "/users/", str(i)) for i in range(3)]
+    for key in keys:
+        store.set(key, response)
+
+    assert len(store) == 2
+    assert store.get(keys[0]) is None, "The oldest key should be evicted"
+    assert store.get(keys[2]) == response
+
+    store.set(KEY, response._replace(body=b"x" * 11))
+    assert store.get(KEY) is None, "Large bodies should not be stored"
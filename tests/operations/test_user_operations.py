@@ -1,8 +1,13 @@
+from datetime import date
 from typing import List
 
-from picpay_case.operations.user import UserOperations
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from picpay_case.operations.user import UserOperations, UserConflictError
 from picpay_case.models.user import User
-from picpay_case.schemas.user import UserCreate, UserUpdate
+from picpay_case.schemas.user import UserCreate, UserFilter, UserUpdate
 
 
 def test_create_user(user_op: UserOperations, user_factory):
@@ -29,12 +34,72 @@ def test_create_user(user_op: UserOperations, user_factory):
         "The name of created user and the retrieved user don't match"
 
 
-def test_duplicate_user(user_op: UserOperations):
+def test_duplicate_user(
+    user_op: UserOperations, existing_user: User, user_factory
+):
     """
-    [PENDING EMAIL FIELD]
     This test validates the creation of duplicate users and expected fails
     """
-    pass
+    user_data = dict(user_factory(), email=existing_user.email)
+    duplicated = user_op.create_user(UserCreate(**user_data))
+
+    assert duplicated is None, "Duplicated email should not be created"
+
+    # The failed insert must not leave the session unusable
+    assert user_op.get_user(existing_user.id) is not None
+
+
+def test_update_user_duplicate_email(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test validates that updating to an email in use is rejected
+    """
+    first, second = existing_users[:2]
+
+    with pytest.raises(UserConflictError):
+        user_op.update_user(first.id, UserUpdate(email=second.email))
+
+    assert user_op.get_user(first.id).email != second.email
+
+
+def test_update_user_not_null(user_op: UserOperations, existing_user: User):
+    """
+    This test validates that only email collisions are reported as
+    conflicts, other integrity errors are not
+    """
+    with pytest.raises(ValueError):
+        UserUpdate(first_name=None)
+
+    with pytest.raises(IntegrityError):
+        user_op.update_user(
+            existing_user.id, UserUpdate.model_construct(first_name=None)
+        )
+
+    assert user_op.get_user(existing_user.id).first_name is not None
+
+
+def test_create_users(
+    user_op: UserOperations, existing_user: User, user_factory
+):
+    """
+    This test creates users in bulk, mixing new emails with emails that
+    already exist in the database or earlier in the same batch
+    """
+    new_users = [user_factory() for _ in range(3)]
+    taken = dict(user_factory(), email=existing_user.email)
+    repeated = dict(user_factory(), email=new_users[0]["email"])
+
+    batch = [UserCreate(**u) for u in new_users + [taken, repeated]]
+    ids = user_op.create_users(batch)
+
+    assert ids[3] is None and ids[4] is None, \
+        "Duplicated emails should be reported as conflicts"
+
+    for user_data, user_id in zip(new_users, ids[:3]):
+        db_user = user_op.get_user(user_id)
+        assert db_user is not None and db_user.email == user_data["email"], \
+            "Created IDs don't match the users in the input order"
 
 
 def test_get_user(user_op: UserOperations, existing_user: User):
@@ -80,6 +145,237 @@ def test_get_users(user_op: UserOperations, existing_users: List[User]):
         "Mismatch in the test-created and database-selected IDs"
 
 
+def test_get_users_keyset_page(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test pages through the users using the last seen ID as the key
+    """
+    e_users_ids = sorted([u.id for u in existing_users])
+
+    first_page = user_op.get_users(limit=2)
+    assert [u.id for u in first_page] == e_users_ids[:2], \
+        "First page should hold the lowest IDs in order"
+
+    next_page = user_op.get_users(limit=2, after_id=first_page[-1].id)
+    assert [u.id for u in next_page] == e_users_ids[2:4], \
+        "Next page should start right after the last seen ID"
+
+    last_page = user_op.get_users(limit=10, after_id=e_users_ids[-1])
+    assert last_page == [], "No users expected after the highest ID"
+
+
+def test_get_users_page_stats(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test validates the page aggregate against the page itself
+    """
+    page = user_op.get_users(limit=3, after_id=existing_users[0].id)
+    count, last_update, id_sum = user_op.get_users_page_stats(
+        limit=3, after_id=existing_users[0].id
+    )
+
+    assert count == len(page)
+    assert last_update == max(u.updated_at for u in page)
+    assert id_sum == sum(u.id for u in page)
+
+
+def test_get_users_filters(user_op: UserOperations, user_factory):
+    """
+    This test validates each filter against users with known values
+    """
+    ana = user_op.create_user(UserCreate(**user_factory(
+        first_name="Ana", last_name="Silva", email="ana@Example.com",
+        birthdate=date(1990, 5, 1)
+    )))
+    bruno = user_op.create_user(UserCreate(**user_factory(
+        first_name="Bruno", last_name="Anacleto", email="bruno@other.org",
+        birthdate=date(1980, 1, 1)
+    )))
+
+    def _ids(**filters):
+        return [u.id for u in user_op.get_users(filters=UserFilter(**filters))]
+
+    assert _ids(name="an") == [ana.id, bruno.id], \
+        "Name prefix should match first or last name, ignoring case"
+    assert _ids(name="sil") == [ana.id]
+    assert _ids(email_domain="EXAMPLE.com") == [ana.id]
+    assert _ids(email="bruno@other.org") == [bruno.id]
+    assert _ids(phone=ana.phone) == [ana.id]
+    assert _ids(birthdate_from=date(1985, 1, 1)) == [ana.id]
+    assert _ids(birthdate_to=date(1985, 1, 1)) == [bruno.id]
+    assert _ids(name="an", created_from=bruno.created_at) == [bruno.id]
+    assert _ids(name="ana", email_domain="other.org") == [bruno.id]
+
+
+def test_get_users_accented_names(user_op: UserOperations, user_factory):
+    """
+    This test validates that name prefixes ignore the case of non-ASCII
+    letters, on created and renamed users
+    """
+    angela = user_op.create_user(UserCreate(**user_factory(
+        first_name="Ângela", last_name="Souza"
+    )))
+    erica = user_op.create_user(UserCreate(**user_factory(
+        first_name="Bia", last_name="Lima"
+    )))
+    user_op.update_user(erica.id, UserUpdate(first_name="Érica"))
+
+    def _ids(name):
+        return [u.id for u in user_op.get_users(filters=UserFilter(name=name))]
+
+    assert _ids("Â") == _ids("â") == _ids("ÂNGELA") == [angela.id]
+    assert _ids("érica") == [erica.id]
+    assert _ids("bia") == [], "The old name should not match anymore"
+
+
+def test_get_users_name_last_code_points(
+    user_op: UserOperations, user_factory
+):
+    """
+    This test validates name prefixes ending in the last code point and in
+    the one before the surrogates, which have no simple successor
+    """
+    users = [
+        user_op.create_user(UserCreate(**user_factory(first_name=name)))
+        for name in ("ana\U0010ffff", "ana\ud7ffb", "anb")
+    ]
+
+    def _ids(name):
+        return [u.id for u in user_op.get_users(filters=UserFilter(name=name))]
+
+    assert _ids("ana\U0010ffff") == [users[0].id]
+    assert _ids("\U0010ffff") == []
+    assert _ids("ana\ud7ff") == [users[1].id]
+
+
+def test_get_users_sorted_keyset_page(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test pages through the users sorted by descending email
+    """
+    expected = sorted(existing_users, key=lambda u: u.email, reverse=True)
+
+    seen, after = [], None
+    while True:
+        page = user_op.get_users(
+            limit=2,
+            sort="-email",
+            after_id=after.id if after else None,
+            after_value=after.email if after else None
+        )
+        if not page:
+            break
+        seen.extend(page)
+        after = page[-1]
+
+    assert [u.id for u in seen] == [u.id for u in expected], \
+        "Pages should follow the sort column and cover every user once"
+
+
+def test_get_users_fields(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test validates that projections load only the requested columns
+    """
+    rows = user_op.get_users(limit=2, fields=("id", "email"))
+
+    assert [tuple(r) for r in rows] == [
+        (u.id, u.email) for u in existing_users[:2]
+    ], "Only the requested columns should be selected, in order"
+    assert not any(isinstance(r, User) for r in rows), \
+        "Projected rows should not be ORM objects"
+
+    row = user_op.get_user(existing_users[0].id, fields=("email",))
+    assert tuple(row) == (existing_users[0].email,)
+
+
+def test_update_users_chunked(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test updates users by ID and by filter in chunks smaller than the
+    selection and validates the affected rows
+    """
+    ids = [u.id for u in existing_users]
+
+    updated = user_op.update_users(
+        UserUpdate(phone="+55 11 0000-0000"), user_ids=ids[:3], chunk_size=2
+    )
+    assert sorted(updated) == ids[:3], "Every selected user should be updated"
+
+    # The filtered column is changed by the update itself
+    updated = user_op.update_users(
+        UserUpdate(phone="+55 11 1111-1111"),
+        filters=UserFilter(phone="+55 11 0000-0000"),
+        chunk_size=2
+    )
+    assert sorted(updated) == ids[:3]
+    assert [user_op.get_user(i).phone for i in ids[:3]] == \
+        ["+55 11 1111-1111"] * 3
+    assert user_op.get_user(ids[3]).phone == existing_users[3].phone, \
+        "Users outside the selection should not change"
+
+
+def test_delete_users_chunked(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test deletes users matching a filter in chunks
+    """
+    ids = [u.id for u in existing_users]
+    user_op.update_users(UserUpdate(last_name="Teste"), user_ids=ids[1:])
+
+    deleted = user_op.delete_users(
+        filters=UserFilter(name="teste"), chunk_size=2
+    )
+
+    assert sorted(deleted) == ids[1:], "Every matching user should be deleted"
+    assert [u.id for u in user_op.get_users()] == ids[:1]
+
+
+def test_search_users_full_text(user_op: UserOperations, user_factory):
+    """
+    This test validates that the FTS index follows inserts, updates and
+    deletes through its triggers
+    """
+    user = user_op.create_user(UserCreate(**user_factory(
+        first_name="Joana", last_name="Prado"
+    )))
+
+    def _search(q):
+        return [u.id for u in user_op.get_users(filters=UserFilter(q=q))]
+
+    assert _search("joa pra") == [user.id], "Words should match as prefixes"
+    assert _search('"prado" OR') == [], "FTS5 syntax should not be parsed"
+
+    user_op.update_user(user.id, UserUpdate(last_name="Moura"))
+    assert _search("prado") == []
+    assert _search("moura") == [user.id]
+
+    user_op.delete_user(user.id)
+    assert _search("joana") == []
+
+
+def test_iter_users_chunks(
+    user_op: UserOperations, existing_users: List[User]
+):
+    """
+    This test streams the users in chunks and validates sizes and order
+    """
+    chunks = list(user_op.iter_users(chunk_size=2))
+
+    assert [len(c) for c in chunks] == [2, 2, 1], \
+        "Users should be yielded in chunks of at most `chunk_size`"
+
+    streamed_ids = [u.id for c in chunks for u in c]
+    assert streamed_ids == sorted([u.id for u in existing_users]), \
+        "Every user should be streamed once, ordered by ID"
+
+
 def test_update_user(user_op: UserOperations, existing_user: User, fake_data):
     """
     This test updates a test-created user and validates the update
@@ -114,6 +410,41 @@ def test_update_user(user_op: UserOperations, existing_user: User, fake_data):
     _compare_updates(updates, db_user)
 
 
+def test_update_and_delete_single_statement(
+    user_op: UserOperations, existing_user: User
+):
+    """
+    This test validates that updates and deletes run a single SQL statement
+    (plus their change feed entry) and that updates move `updated_at`
+    forward
+    """
+    statements = []
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    previous_update = existing_user.updated_at
+    engine = user_op.db.get_bind()
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        updated = user_op.update_user(
+            existing_user.id, UserUpdate(first_name="Renamed")
+        )
+        assert [s.split()[0] for s in statements] == ["UPDATE", "INSERT"], \
+            f"Expected one UPDATE and its change: {statements}"
+
+        statements.clear()
+        assert user_op.delete_user(existing_user.id) is True
+        assert [s.split()[0] for s in statements] == ["DELETE", "INSERT"], \
+            f"Expected one DELETE and its change: {statements}"
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    assert updated.first_name == "Renamed"
+    assert updated.updated_at > previous_update, \
+        "updated_at should move forward on updates"
+
+
 def test_update_non_existing_user(user_op: UserOperations):
     """
     This test attempts to update a non-existing user and validate it's resposes
@@ -139,3 +470,45 @@ def test_delete_non_existing_user(user_op: UserOperations):
     """
     deleted = user_op.delete_user(user_id=999)
     assert deleted is False, "Invalid response while deleting invalid user"
+
+
+def test_change_feed_records_writes(user_op: UserOperations, user_factory):
+    """
+    This test validates that every write appends to the change feed, and
+    that the feed returns the current state of each user
+    """
+    created = user_op.create_user(UserCreate(**user_factory()))
+    user_op.create_users([UserCreate(**user_factory()) for _ in range(2)])
+    user_op.update_user(created.id, UserUpdate(first_name="Feed"))
+    user_op.update_user(created.id + 100, UserUpdate(first_name="Nobody"))
+    user_op.delete_user(created.id)
+
+    changes = user_op.get_changes()
+    assert [c.operation for c, _ in changes] == \
+        ["create", "create", "create", "update", "delete"]
+    assert all(user is None for c, user in changes
+               if c.user_id == created.id), "Deleted users have no state"
+
+    after = user_op.get_changes(since=changes[1][0].id, limit=2)
+    assert [c.id for c, _ in after] == [c.id for c, _ in changes[2:4]]
+
+
+def test_compact_changes(user_op: UserOperations, user_factory):
+    """
+    This test validates that the compaction keeps the newest change of
+    each user and moves the horizon past the expired changes
+    """
+    users = user_op.create_users(
+        [UserCreate(**user_factory()) for _ in range(2)]
+    )
+    user_op.update_user(users[0], UserUpdate(first_name="Novo"))
+
+    assert user_op.compact_changes(retention=3600) == (1, 0)
+    assert [(c.user_id, c.operation) for c, _ in user_op.get_changes()] == \
+        [(users[1], "create"), (users[0], "update")]
+    assert user_op.get_change_cursors()[0] == 0
+
+    assert user_op.compact_changes(retention=-1) == (0, 2)
+    horizon, latest = user_op.get_change_cursors()
+    assert horizon == latest and horizon > 0
+    assert user_op.get_changes() == []
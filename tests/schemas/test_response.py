@@ -0,0 +1,53 @@
+import json
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from picpay_case.models.user import User
+from picpay_case.schemas.response import success_json, success_response
+from picpay_case.schemas.user import UserResponse, user_list_adapter
+
+
+def _encode_like_fastapi(content) -> bytes:
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+    ).encode()
+
+
+def test_success_json_matches_success_response(user_factory):
+    """
+    This test validates that the fast path renders the same bytes as the
+    envelope model encoded by FastAPI
+    """
+    timestamps = [datetime(2024, 1, 1, 12, 30, 0, ms) for ms in (0, 5, 4000)]
+    users = [
+        User(
+            id=i,
+            **dict(user_factory(), first_name="Zoë"),
+            created_at=ts,
+            updated_at=ts
+        )
+        for i, ts in enumerate(timestamps)
+    ]
+    models = [UserResponse.model_validate(u) for u in users]
+
+    expected = _encode_like_fastapi(
+        success_response(models, message="Olá", next_cursor="abc")
+    )
+    fast = success_json(
+        user_list_adapter.validate_python(users, from_attributes=True),
+        message="Olá",
+        next_cursor="abc"
+    )
+    assert fast == expected
+
+
+def test_success_json_empty_data():
+    """
+    This test validates the empty data and default message of the envelope
+    """
+    assert success_json([]) == _encode_like_fastapi(success_response([]))
@@ -0,0 +1,38 @@
+from picpay_case.database import create_db_engine, engine_options
+
+
+def test_engine_options_per_url():
+    """
+    This test validates that pool and driver arguments are only sent to
+    the databases that accept them
+    """
+    memory = engine_options("sqlite://")
+    assert "pool_size" not in memory, \
+        "In-memory SQLite uses a single connection pool"
+    assert memory["connect_args"] == {"check_same_thread": False}
+
+    file_db = engine_options("sqlite:///users.sqlite")
+    assert file_db["pool_size"] > 0
+
+    assert "connect_args" not in engine_options("sqlite+aiosqlite:///u.db")
+    assert "connect_args" not in engine_options("postgresql://u@h/db"), \
+        "check_same_thread should only be sent to the sqlite3 driver"
+
+
+def test_sqlite_pragmas_on_connect(tmp_path):
+    """
+    This test validates the PRAGMAs set on every new SQLite connection
+    """
+    db_engine = create_db_engine(f"sqlite:///{tmp_path / 'pragmas.sqlite'}")
+    try:
+        with db_engine.connect() as conn:
+            def _pragma(name):
+                return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+            assert _pragma("journal_mode") == "wal"
+            assert _pragma("synchronous") == 1, "Expected synchronous=NORMAL"
+            assert _pragma("busy_timeout") == 5000
+            assert _pragma("temp_store") == 2, "Expected temp_store=MEMORY"
+            assert _pragma("cache_size") == -64000
+    finally:
+        db_engine.dispose()
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import create_engine, delete, inspect, select
+from sqlalchemy.orm import Session
+
+from picpay_case.migrations import (
+    MIGRATIONS, MigrationError, migrate, schema_migrations
+)
+from picpay_case.models.user import User
+from picpay_case.operations.user import UserOperations
+from picpay_case.schemas.user import UserFilter
+
+
+def test_migrate_creates_schema_and_records_versions():
+    """
+    This test migrates an empty database and validates the created tables
+    and the recorded migration versions
+    """
+    engine = create_engine("sqlite:///:memory:")
+
+    applied = migrate(engine)
+
+    assert applied == [v for v, _, _ in MIGRATIONS], \
+        "Every migration should be applied on an empty database"
+    assert "users" in inspect(engine).get_table_names(), \
+        "Users table was not created by the migrations"
+
+    with engine.connect() as conn:
+        versions = conn.scalars(select(schema_migrations.c.version)).all()
+    assert sorted(versions) == applied, "Applied versions were not recorded"
+
+
+def test_migrate_is_idempotent():
+    """
+    This test validates that migrating an up to date database is a no-op
+    """
+    engine = create_engine("sqlite:///:memory:")
+    migrate(engine)
+
+    assert migrate(engine) == [], "No migrations should be pending"
+
+
+def test_folded_names_backfill(user_factory, tmp_path):
+    """
+    This test takes a database back to before the folded name columns and
+    validates that their migration fills them for the existing users
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'names.sqlite'}")
+    migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            dict(user_factory(first_name="Ângela")),
+            dict(user_factory(first_name="Érica")),
+        ])
+        for name in ("first_name", "last_name"):
+            conn.exec_driver_sql(f"DROP INDEX ix_users_{name}_folded")
+            conn.exec_driver_sql(
+                f"ALTER TABLE users DROP COLUMN {name}_folded"
+            )
+        conn.execute(
+            delete(schema_migrations).where(schema_migrations.c.version == 6)
+        )
+        updated_at = conn.scalars(select(User.updated_at)).all()
+
+    assert migrate(engine) == [6]
+
+    with engine.connect() as conn:
+        assert conn.scalars(select(User.updated_at)).all() == updated_at, \
+            "The backfill isn't a change of the users"
+    with Session(engine) as db:
+        users = UserOperations(db).get_users(filters=UserFilter(name="â"))
+    assert [u.first_name for u in users] == ["Ângela"]
+
+
+def test_unique_email_duplicates(user_factory):
+    """
+    This test takes a database back to before the unique email index, with
+    duplicated emails, and validates that its migration lists them
+    """
+    engine = create_engine("sqlite:///:memory:")
+    migrate(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_users_email")
+        conn.execute(User.__table__.insert(), [
+            dict(user_factory(email="dup@example.com")),
+            dict(user_factory(email="dup@example.com")),
+            dict(user_factory(email="unique@example.com")),
+        ])
+        conn.execute(
+            delete(schema_migrations).where(schema_migrations.c.version == 2)
+        )
+
+    with pytest.raises(MigrationError, match="dup@example.com") as err:
+        migrate(engine)
+    assert "unique@example.com" not in str(err.value)
+
+    with engine.connect() as conn:
+        versions = conn.scalars(select(schema_migrations.c.version)).all()
+    assert 2 not in versions, "The failed migration was recorded"
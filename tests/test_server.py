@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from picpay_case import server
+from picpay_case.core.config import settings
+
+
+def test_serve_migrates_before_workers(monkeypatch):
+    """
+    This test validates that the launcher migrates once, leaves the
+    migrations out of the workers and runs one worker per CPU
+    """
+    calls = []
+    monkeypatch.setattr(server, "migrate", lambda: calls.append("migrate"))
+    monkeypatch.setattr(
+        server.uvicorn, "run",
+        lambda app, **options: calls.append((app, options))
+    )
+    monkeypatch.setattr(settings, "auto_migrate", True)
+    monkeypatch.setattr(settings, "server_workers", None)
+    monkeypatch.setattr(settings, "server_max_requests", 0)
+    monkeypatch.setenv("AUTO_MIGRATE", "true")
+
+    server.serve()
+
+    assert calls[0] == "migrate"
+    app, options = calls[1]
+    assert app == "picpay_case.main:app"
+    assert options["workers"] == server.cpu_count()
+    assert options["limit_max_requests"] is None
+    assert options["access_log"] is True, "uvicorn's default is kept"
+    assert os.environ["AUTO_MIGRATE"] == "false", \
+        "Workers shouldn't migrate again"
+    assert settings.auto_migrate is False
+
+
+@pytest.mark.parametrize("workers, env, expected", [
+    (2, None, "false"),
+    (2, "true", "true"),
+    (1, None, None),
+])
+def test_serve_cache_per_worker(monkeypatch, workers, env, expected):
+    """
+    This test validates that the per worker user cache is off by default
+    with many workers, unless it is enabled explicitly
+    """
+    monkeypatch.setattr(server.uvicorn, "run", lambda app, **options: None)
+    monkeypatch.setattr(settings, "auto_migrate", False)
+    monkeypatch.setattr(settings, "server_workers", workers)
+    if env is None:
+        monkeypatch.delenv("CACHE_ENABLED", raising=False)
+    else:
+        monkeypatch.setenv("CACHE_ENABLED", env)
+
+    server.serve()
+
+    assert os.environ.get("CACHE_ENABLED") == expected
+
+
+@pytest.mark.parametrize("files, expected", [
+    ({"cpu.max": "150000 100000\n"}, 1.5),
+    ({"cpu.max": "max 100000\n"}, None),
+    ({"cpu/cpu.cfs_quota_us": "200000", "cpu/cpu.cfs_period_us": "100000"},
+     2.0),
+    ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"},
+     None),
+    ({}, None),
+])
+def test_cgroup_cpu_limit(tmp_path, files, expected):
+    """
+    This test validates the CPU quota read from cgroup v2 and v1 files
+    """
+    for name, content in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(content)
+
+    assert server.cgroup_cpu_limit(tmp_path) == expected
+
+
+def test_cpu_count_cgroup_quota(monkeypatch):
+    """
+    This test validates that a CPU quota caps the workers below the CPUs
+    the process may run on
+    """
+    monkeypatch.setattr(
+        os, "sched_getaffinity", lambda pid: {0, 1, 2, 3}, raising=False
+    )
+    monkeypatch.setattr(server, "cgroup_cpu_limit", lambda: 1.5)
+    assert server.cpu_count() == 2
+
+    monkeypatch.setattr(server, "cgroup_cpu_limit", lambda: None)
+    assert server.cpu_count() == 4